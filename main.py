@@ -1,17 +1,77 @@
+import sys
 from sys import argv
 from src.utils import read_json, AssetInfo
 from src.live_feed import LiveFeed
 from src.data_feed import DataFeed
+from src.shard import ShardSupervisor
+
+OFFLINE_COMMANDS = ("analytics", "convert", "bench-decoders")
 
 
 def main():
     conf = read_json("config.json")
     pair_names = conf["repo"]["pairNames"]
+
+    if "bench" in argv[1:]:
+        from src.bench import run_bench
+
+        # synthetic streams, no asset info needed
+        regressions = run_bench(conf)
+        sys.exit(1 if regressions else 0)
     # pair_names = pair_names[:2]
 
-    assetInfo = AssetInfo()
+    # the commands that only read the repo need no network
+    offline = any(cmd in argv[1:] for cmd in OFFLINE_COMMANDS)
+    assetInfo = AssetInfo.from_conf(conf.get("assetInfo", {}), offline)
     assetPairs = [assetInfo.get_asset_pair(name) for name in pair_names]
 
+    if "analytics" in argv[1:]:
+        from src.analytics import run_analytics  # needs numpy
+
+        analytics_conf = conf.get("analytics", {})
+        workers = analytics_conf.get("workers")
+        bar_seconds = analytics_conf.get("barSeconds", 60)
+        out_path = analytics_conf.get("outPath")
+        run_analytics(conf, assetPairs, workers, bar_seconds, out_path)
+        return
+
+    if "convert" in argv[1:]:
+        from src.columnar import convert_repo  # needs numpy
+
+        columnar_conf = conf.get("columnar", {})
+        out_dir = columnar_conf.get("outDir", "columns")
+        convert_repo(conf, assetPairs, out_dir, columnar_conf.get("workers"))
+        return
+
+    if "bench-decoders" in argv[1:]:
+        from src.wsapi.decoders import bench_decoders, get_recorded_frames
+
+        frames = get_recorded_frames(conf, assetPairs[0], limit=20000)
+        for name, us in bench_decoders(frames).items():
+            print(f"{name:8} {us:8.2f} us/frame")
+        return
+
+    if "replay-server" in argv[1:]:
+        import asyncio
+        from src.replay_server import ReplayServer  # needs websockets
+
+        replayServer = ReplayServer.from_conf(conf, assetPairs)
+        asyncio.run(replayServer.serve())
+        return
+
+    if "load-test" in argv[1:]:
+        from src.load_test import run_load_test  # needs websockets
+
+        report = run_load_test(conf, assetPairs)
+        print(f"\nsustained: {report['sustained']} msg/s")
+        print(f"saturation: {report['saturation']} msg/s")
+        return
+
+    if conf.get("sharding", {}).get("shards", 1) > 1:
+        shardSupervisor = ShardSupervisor.from_conf(conf, assetPairs)
+        shardSupervisor.run()
+        return
+
     liveFeed = LiveFeed(conf, assetPairs, save_to_repo=True)
     liveFeed.feed()
 
@@ -0,0 +1,171 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Optional
+from .book import Book
+from .book_arrays import BookArrays
+from .repo import RepoReader, read_file
+from .utils import AssetPair
+
+
+"""
+Batch analytics over the repo, in a process pool.
+
+The work is split by (pair, file): every file starts with a snapshot of
+the full book (see RepoWriter), so each file can be replayed on its own.
+Workers return partial results that are merged into one output:
+
+bars:   {bar start: {"open", "high", "low", "close", "n"}} of the mid price
+spread: count / sum / sum of squares / min / max of the spread
+depth:  mean cumulative volume per level and side
+
+conf["analytics"]: {"workers": null, "barSeconds": 60, "outPath": null}
+"""
+
+
+def get_tasks(
+    conf: dict[str, Any], assetPairs: list[AssetPair], bar_seconds: int = 60
+) -> list[tuple]:
+    """ one task per (pair, file), largest files first to balance the pool """
+    depth = conf["repo"]["depth"]
+    data_dir = conf["repo"]["dataDir"]
+    fixed_point = conf["repo"].get("fixedPoint", False)
+
+    tasks = []
+    for assetPair in assetPairs:
+        repoReader = RepoReader("KRAKEN", f"BOOK{depth}", assetPair.name, data_dir)
+        for file_path in repoReader.file_paths:
+            tasks.append((assetPair, file_path, depth, fixed_point, bar_seconds))
+    return sorted(tasks, key=lambda task: -os.path.getsize(task[1]))
+
+
+def new_result(depth: int) -> dict:
+    return {
+        "bars": {},
+        "spread": {"n": 0, "sum": 0.0, "sum_sq": 0.0, "min": np.inf, "max": -np.inf},
+        "depth": {"n": 0, "asks": np.zeros(depth), "bids": np.zeros(depth)},
+    }
+
+
+def _update_bar(bars: dict, bar: int, tor: float, mid: float) -> None:
+    if bar not in bars:
+        bars[bar] = {"t0": tor, "t1": tor, "open": mid, "high": mid, "low": mid}
+        bars[bar].update({"close": mid, "n": 0})
+
+    row = bars[bar]
+    row.update({"t1": tor, "close": mid, "n": row["n"] + 1})
+    row["high"] = max(row["high"], mid)
+    row["low"] = min(row["low"], mid)
+
+
+def analyze_file(task: tuple) -> tuple[str, dict]:
+    """ worker: replays one file and returns (pair name, partial result) """
+    assetPair, file_path, depth, fixed_point, bar_seconds = task
+    book = Book(assetPair, depth, None, fixed_point)
+    bookArrays = BookArrays(book)
+    result = new_result(depth)
+    spread, depths = result["spread"], result["depth"]
+
+    for data in read_file(file_path):
+        book.parse_ws_data(data["data"])
+        if not book.insync or not len(book.asks) or not len(book.bids):
+            continue
+
+        best_ask = float(bookArrays.best("asks"))
+        best_bid = float(bookArrays.best("bids"))
+        bar = int(data["tor"] // bar_seconds * bar_seconds)
+        _update_bar(result["bars"], bar, data["tor"], (best_ask + best_bid) / 2)
+
+        diff = best_ask - best_bid
+        spread["n"] += 1
+        spread["sum"] += diff
+        spread["sum_sq"] += diff * diff
+        spread["min"] = min(spread["min"], diff)
+        spread["max"] = max(spread["max"], diff)
+
+        depths["n"] += 1
+        for side in ("asks", "bids"):
+            cum = bookArrays.cumulative_depth(side)
+            depths[side][: len(cum)] += cum
+            depths[side][len(cum) :] += cum[-1]
+
+    return assetPair.name, result
+
+
+def merge_result(target: dict, result: dict) -> None:
+    """ merges a partial result into target, in any order """
+    for bar, row in result["bars"].items():
+        other = target["bars"].get(bar)
+        if other is None:
+            target["bars"][bar] = row
+            continue
+
+        first, last = sorted((other, row), key=lambda r: r["t0"])
+        merged = {"t0": first["t0"], "t1": max(first["t1"], last["t1"])}
+        merged["open"] = first["open"]
+        merged["close"] = (other if other["t1"] >= row["t1"] else row)["close"]
+        merged["high"] = max(other["high"], row["high"])
+        merged["low"] = min(other["low"], row["low"])
+        merged["n"] = other["n"] + row["n"]
+        target["bars"][bar] = merged
+
+    spread, other = target["spread"], result["spread"]
+    for key in ("n", "sum", "sum_sq"):
+        spread[key] += other[key]
+    spread["min"] = min(spread["min"], other["min"])
+    spread["max"] = max(spread["max"], other["max"])
+
+    for key in ("n", "asks", "bids"):
+        target["depth"][key] = target["depth"][key] + result["depth"][key]
+
+
+def summarize(result: dict) -> dict:
+    """ JSON friendly output of a merged result """
+    spread = result["spread"]
+    n = max(spread["n"], 1)
+    mean = spread["sum"] / n
+    depth_n = max(result["depth"]["n"], 1)
+
+    return {
+        "bars": {bar: result["bars"][bar] for bar in sorted(result["bars"])},
+        "spread": {
+            "n": spread["n"],
+            "mean": mean,
+            "std": max(spread["sum_sq"] / n - mean * mean, 0.0) ** 0.5,
+            "min": spread["min"] if spread["n"] else None,
+            "max": spread["max"] if spread["n"] else None,
+        },
+        "depth": {
+            side: (result["depth"][side] / depth_n).tolist()
+            for side in ("asks", "bids")
+        },
+    }
+
+
+def run_analytics(
+    conf: dict[str, Any],
+    assetPairs: list[AssetPair],
+    workers: Optional[int] = None,
+    bar_seconds: int = 60,
+    out_path: Optional[str] = None,
+) -> dict[str, dict]:
+    """
+    replays all files of all pairs in a process pool (workers: number of
+    processes, default os.cpu_count()) and merges the results by pair.
+    """
+    depth = conf["repo"]["depth"]
+    tasks = get_tasks(conf, assetPairs, bar_seconds)
+    results = {assetPair.name: new_result(depth) for assetPair in assetPairs}
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(analyze_file, task) for task in tasks]
+        for future in as_completed(futures):
+            pair_name, result = future.result()
+            merge_result(results[pair_name], result)
+
+    summary = {name: summarize(result) for name, result in results.items()}
+    if out_path is not None:
+        with open(out_path, "w") as file:
+            json.dump(summary, file)
+    return summary
@@ -0,0 +1 @@
+from .runner import run_bench, run_benchmarks, compare_results
@@ -0,0 +1,168 @@
+from typing import Callable, Optional
+from ..book import Book, compute_checksum
+from ..repo import REPO_WRITERS, RepoReader, RotationPolicy
+from ..utils import AssetPair
+
+
+"""
+Benchmark cases. A case sets up its state from a stream of synthetic
+updates (snapshot first, see synthetic) and returns:
+
+run:      the timed part
+n_ops:    operations run performs (results are per operation)
+teardown: untimed clean up (closing files), or None
+
+micro: one function of Book / RepoWriter / RepoReader on its own
+macro: the recording path (apply, checksum, write) and the replay path
+       (data_generator, apply) end to end
+"""
+
+Case = tuple[Callable[[], None], int, Optional[Callable[[], None]]]
+
+EXCHANGE = "KRAKEN"
+PAIR = AssetPair("XXBTZUSD", {})
+# one file for the whole run
+ROTATION = RotationPolicy(interval=1 << 40)
+
+
+def get_book(updates: list[dict], depth: int, fixed_point: bool = False) -> Book:
+    book = Book(PAIR, depth, fixed_point=fixed_point)
+    for data in updates:
+        book.parse_ws_data(data)
+    return book
+
+
+def get_records(updates: list[dict]) -> list[dict]:
+    """ as Book passes them to write_line """
+    return [{"status": True, "id": i, "data": data} for i, data in enumerate(updates)]
+
+
+def record(updates: list[dict], depth: int, data_dir: str, record_format: str):
+    repoWriter = REPO_WRITERS[record_format](
+        EXCHANGE, f"BOOK{depth}", PAIR.name, data_dir, rotation=ROTATION
+    )
+    for data in get_records(updates):
+        repoWriter.write_line(data)
+    repoWriter.close_file()
+
+
+def get_reader(depth: int, data_dir: str) -> RepoReader:
+    return RepoReader(EXCHANGE, f"BOOK{depth}", PAIR.name, data_dir)
+
+
+def parse_ws_data(
+    updates: list[dict], depth: int, data_dir: str, fixed_point: bool = False
+) -> Case:
+    book = get_book(updates[:1], depth, fixed_point)
+
+    def run():
+        for data in updates[1:]:
+            book.parse_ws_data(data)
+
+    return run, len(updates) - 1, None
+
+
+def parse_ws_data_fixed(updates: list[dict], depth: int, data_dir: str) -> Case:
+    return parse_ws_data(updates, depth, data_dir, fixed_point=True)
+
+
+def checksum(updates: list[dict], depth: int, data_dir: str) -> Case:
+    """ with the checksum input rebuilt, as after a change of the top levels """
+    book = get_book(updates, depth)
+    n = len(updates)
+
+    def run():
+        for _ in range(n):
+            book.asks._checksum_bytes = None
+            book.bids._checksum_bytes = None
+            compute_checksum(book.asks, book.bids)
+
+    return run, n, None
+
+
+def get_snapshot(updates: list[dict], depth: int, data_dir: str) -> Case:
+    """ both sides, full depth """
+    book = get_book(updates, depth)
+    n = max(len(updates) // 10, 1)
+
+    def run():
+        for _ in range(n):
+            book.get_snapshot("asks")
+            book.get_snapshot("bids")
+
+    return run, n, None
+
+
+def write_line(
+    updates: list[dict], depth: int, data_dir: str, record_format: str = "jsonl"
+) -> Case:
+    repoWriter = REPO_WRITERS[record_format](
+        EXCHANGE, f"BOOK{depth}", PAIR.name, data_dir, rotation=ROTATION
+    )
+    records = get_records(updates)
+
+    def run():
+        for data in records:
+            repoWriter.write_line(data)
+
+    return run, len(records), repoWriter.close_file
+
+
+def write_line_binary(updates: list[dict], depth: int, data_dir: str) -> Case:
+    return write_line(updates, depth, data_dir, record_format="binary")
+
+
+def data_generator(
+    updates: list[dict], depth: int, data_dir: str, record_format: str = "jsonl"
+) -> Case:
+    """ reads an archived (zipped) file """
+    record(updates, depth, data_dir, record_format)
+    repoReader = get_reader(depth, data_dir)
+
+    def run():
+        for _ in repoReader.data_generator():
+            pass
+
+    return run, len(updates), None
+
+
+def data_generator_binary(updates: list[dict], depth: int, data_dir: str) -> Case:
+    return data_generator(updates, depth, data_dir, record_format="binary")
+
+
+def record_updates(updates: list[dict], depth: int, data_dir: str) -> Case:
+    """ live: every update applied, checked and written """
+    book = Book(PAIR, depth, data_dir, writer_kwargs={"rotation": ROTATION})
+
+    def run():
+        for data in updates:
+            book.parse_ws_data(data)
+
+    return run, len(updates), book.repoWriter.close_file
+
+
+def replay(updates: list[dict], depth: int, data_dir: str) -> Case:
+    """ DataFeed: the recording read and applied again """
+    record(updates, depth, data_dir, "jsonl")
+    repoReader = get_reader(depth, data_dir)
+    book = Book(PAIR, depth)
+
+    def run():
+        for data in repoReader.data_generator():
+            book.parse_ws_data(data["data"])
+
+    return run, len(updates), None
+
+
+CASES: dict[str, Callable[[list[dict], int, str], Case]] = {
+    "micro.parse_ws_data": parse_ws_data,
+    "micro.parse_ws_data_fixed": parse_ws_data_fixed,
+    "micro.compute_checksum": checksum,
+    "micro.get_snapshot": get_snapshot,
+    "micro.write_line": write_line,
+    "micro.write_line_binary": write_line_binary,
+    "micro.data_generator": data_generator,
+    "micro.data_generator_binary": data_generator_binary,
+    "macro.record": record_updates,
+    "macro.replay": replay,
+}
@@ -0,0 +1,156 @@
+import io
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import contextlib
+from statistics import median
+from typing import Any, Optional
+from ..synthetic import synthetic_updates
+from .cases import CASES
+
+
+"""
+Reproducible benchmarks of Book, compute_checksum, RepoWriter and
+RepoReader (see cases), on seeded synthetic streams of every depth.
+
+Every case runs repeat times on a fresh setup; results are microseconds
+per operation (best and median), written to outPath as JSON. Given a
+baseline (a results file of an earlier run), the cases whose best time
+got slower by more than tolerance are flagged as regressions. To make a
+run the baseline, copy its results file to the baseline path.
+
+conf["bench"]:
+{"depths": [10, 100, 1000], "updates": 5000, "seed": 0, "repeat": 5,
+ "cases": null, "outPath": "bench.json", "baseline": "bench_baseline.json",
+ "tolerance": 0.1}
+
+cases: names of the cases to run (see cases.CASES), null: all
+"""
+
+
+def get_streams(depths: list[int], n_updates: int, seed: int) -> dict[int, list]:
+    return {depth: list(synthetic_updates(depth, seed, n_updates)) for depth in depths}
+
+
+def time_case(case, updates: list[dict], depth: int, repeat: int) -> dict[str, Any]:
+    times = []
+    for _ in range(repeat):
+        data_dir = tempfile.mkdtemp(prefix="bench_")
+        try:
+            # RepoWriter / RepoReader print about every file
+            with contextlib.redirect_stdout(io.StringIO()):
+                run, n_ops, teardown = case(updates, depth, data_dir)
+                gc.collect()
+                gc.disable()
+                try:
+                    start = time.perf_counter()
+                    run()
+                    times.append((time.perf_counter() - start) / n_ops)
+                finally:
+                    gc.enable()
+                if teardown is not None:
+                    teardown()
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "best_us": min(times) * 1e6,
+        "median_us": median(times) * 1e6,
+        "ops": n_ops,
+    }
+
+
+def run_benchmarks(
+    depths: Optional[list[int]] = None,
+    n_updates: int = 5000,
+    seed: int = 0,
+    repeat: int = 5,
+    names: Optional[list[str]] = None,
+) -> dict[str, Any]:
+    """ names: cases to run (default: all), results by "<case>/depth<depth>" """
+    depths = depths or [10, 100, 1000]
+    streams = get_streams(depths, n_updates, seed)
+    results = {}
+    for name, case in CASES.items():
+        if names is not None and name not in names:
+            continue
+        for depth, updates in streams.items():
+            key = f"{name}/depth{depth}"
+            results[key] = time_case(case, updates, depth, repeat)
+            print(f"{key:40} {results[key]['best_us']:10.2f} us/op", flush=True)
+
+    return {
+        "meta": {
+            "time": time.time(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "depths": depths,
+            "updates": n_updates,
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare_results(
+    results: dict[str, Any], baseline: dict[str, Any], tolerance: float = 0.1
+) -> list[dict[str, Any]]:
+    """ every case of both, by change of the best time ("regression": slower) """
+    changes = []
+    for key, result in results["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        change = result["best_us"] / base["best_us"] - 1.0
+        changes.append(
+            {
+                "case": key,
+                "baseline_us": base["best_us"],
+                "best_us": result["best_us"],
+                "change": change,
+                "regression": change > tolerance,
+            }
+        )
+    return sorted(changes, key=lambda change: -change["change"])
+
+
+def print_comparison(changes: list[dict[str, Any]]) -> None:
+    for change in changes:
+        flag = "REGRESSION" if change["regression"] else ""
+        print(
+            f"{change['case']:40} {change['baseline_us']:10.2f} ->"
+            f" {change['best_us']:10.2f} us/op {change['change']:+7.1%} {flag}"
+        )
+
+
+def run_bench(conf: dict[str, Any]) -> list[dict[str, Any]]:
+    """ runs conf["bench"], returns the regressions against its baseline """
+    bench_conf = conf.get("bench", {})
+    results = run_benchmarks(
+        depths=bench_conf.get("depths", [10, 100, 1000]),
+        n_updates=bench_conf.get("updates", 5000),
+        seed=bench_conf.get("seed", 0),
+        repeat=bench_conf.get("repeat", 5),
+        names=bench_conf.get("cases"),
+    )
+    out_path = bench_conf.get("outPath")
+    if out_path is not None:
+        with open(out_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+    baseline_path = bench_conf.get("baseline")
+    if baseline_path is None or not os.path.exists(baseline_path):
+        print("no baseline to compare with")
+        return []
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+
+    changes = compare_results(results, baseline, bench_conf.get("tolerance", 0.1))
+    print_comparison(changes)
+    return [change for change in changes if change["regression"]]
@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import mmap
+import struct
+from typing import Iterable, Iterator, Optional
+from .utils import get_decimals, from_fixed
+from .raw_frame import decode_raw, encode_raw
+from .segment import iter_chunks
+
+
+"""
+Binary record format of the repo ("recordFormat": "binary" in config.json).
+
+file:   HEADER RECORD RECORD ...
+HEADER: magic, price / volume / timestamp decimals
+RECORD: length (of everything that follows), RECORD_HEAD, asks ROWs, bids ROWs
+ROW:    price, volume, timestamp as integers scaled by the header decimals,
+        followed by the republish ("r") flag
+
+The decimals are learned from the first record of a file. A record that
+does not fit them (or the expected shape) is stored as JSON instead, with
+the JSON flag set.
+
+Decoding only unpacks the integers: the rows of a side are a FixedRows,
+which builds the decimal strings when they are read (see FixedRows.ints
+for the integers themselves).
+"""
+
+MAGIC = b"KOB1"
+HEADER = struct.Struct("<4sBBB")
+LENGTH = struct.Struct("<I")
+RECORD_HEAD = struct.Struct("<BQdIII")  # flags, id, tor, checksum, n_asks, n_bids
+ROW = struct.Struct("<qqqB")
+
+STATUS = 1
+CHECKSUM = 2
+SNAPSHOT = 4
+ASKS = 8
+BIDS = 16
+JSON = 128
+
+RECORD_KEYS = {"status", "id", "data", "tor"}
+SNAPSHOT_KEYS = {"as", "bs"}
+UPDATE_KEYS = {"a", "b", "c"}
+
+
+def learn_precision(data: dict) -> tuple[int, int, int]:
+    """ returns the (price, volume, timestamp) decimals of the first row """
+    for key in ("as", "bs", "a", "b"):
+        rows = data.get(key)
+        if rows:
+            return tuple(get_decimals(value) for value in rows[0][:3])
+    return 0, 0, 0
+
+
+def encode_header(precision: tuple[int, int, int]) -> bytes:
+    return HEADER.pack(MAGIC, *precision)
+
+
+def read_header(file_path: str) -> tuple[int, int, int]:
+    head = next(iter_chunks(file_path, HEADER.size), b"")[: HEADER.size]
+    magic, *precision = HEADER.unpack(head.ljust(HEADER.size, b"\0"))
+    if magic != MAGIC:
+        raise ValueError(f"not a binary repo file: {file_path}")
+    return tuple(precision)
+
+
+def _number_pattern(decimals: int) -> str:
+    """ the values that from_fixed creates, e.g. "0.5", "12.50" (decimals 2) """
+    whole = "(?:0|[1-9][0-9]*)"
+    return whole + rf"\.[0-9]{{{decimals}}}" if decimals else whole
+
+
+_patterns: dict[tuple, tuple[re.Pattern, re.Pattern]] = {}
+
+
+def _get_patterns(precision: tuple) -> tuple[re.Pattern, re.Pattern]:
+    """
+    what the binary format stores exactly: rows joined by "\n" without
+    any republish flag, and one row with or without it
+    """
+    patterns = _patterns.get(precision)
+    if patterns is None:
+        row = " ".join(_number_pattern(decimals) for decimals in precision)
+        patterns = (re.compile(f"{row}(?:\n{row})*"), re.compile(row + "(?: r)?"))
+        _patterns[precision] = patterns
+    return patterns
+
+
+def _is_checksum(value) -> bool:
+    return isinstance(value, str) and value.isdigit() and value == str(int(value))
+
+
+def _row_values(rows: list[list[str]], precision: tuple) -> Optional[list[int]]:
+    """
+    the ROW values of rows, None if one does not fit precision. Without
+    any republish flag, the flags are left out (see _record_struct).
+    """
+    rows_pattern, row_pattern = _get_patterns(precision)
+    text = "\n".join(map(" ".join, rows))
+    # 3 numbers per line and 3 values per row: all converted in one go
+    if sum(map(len, rows)) == 3 * len(rows) and rows_pattern.fullmatch(text):
+        values = list(map(int, text.replace(".", "").split()))
+        if len(values) == 3 * len(rows):  # no value held a "\n"
+            return values
+
+    values = []
+    for row in rows:
+        if not row_pattern.fullmatch(" ".join(row)):
+            return None
+        values += (
+            int(row[0].replace(".", "")),
+            int(row[1].replace(".", "")),
+            int(row[2].replace(".", "")),
+            len(row) - 3,
+        )
+    return values
+
+
+_record_structs: dict[tuple[int, bool], struct.Struct] = {}
+
+
+def _record_struct(n_rows: int, republish: bool) -> struct.Struct:
+    """
+    LENGTH, RECORD_HEAD and n_rows ROWs, packed in one go. republish False:
+    the republish flags are left out of the values and packed as 0
+    """
+    record_struct = _record_structs.get((n_rows, republish))
+    if record_struct is None:
+        row_format = ROW.format[1:] if republish else ROW.format[1:-1] + "x"
+        head_format = LENGTH.format + RECORD_HEAD.format[1:]
+        record_struct = struct.Struct(head_format + row_format * n_rows)
+        _record_structs[(n_rows, republish)] = record_struct
+    return record_struct
+
+
+def _encode_binary(record: dict, precision: tuple) -> Optional[bytes]:
+    """ the record with its LENGTH, None if it does not fit the format """
+    data = record["data"]
+    if record.keys() != RECORD_KEYS:
+        return None
+
+    snapshot = "as" in data or "bs" in data
+    if not data.keys() <= (SNAPSHOT_KEYS if snapshot else UPDATE_KEYS):
+        return None
+
+    asks = data.get("as" if snapshot else "a")
+    bids = data.get("bs" if snapshot else "b")
+    checksum = data.get("c")
+    if checksum is not None and not _is_checksum(checksum):
+        return None
+
+    flags = STATUS if record["status"] else 0
+    flags |= SNAPSHOT if snapshot else 0
+    flags |= ASKS if asks is not None else 0
+    flags |= BIDS if bids is not None else 0
+    flags |= CHECKSUM if checksum is not None else 0
+
+    rows = (asks or []) + (bids or [])
+    n_asks, n_rows = len(asks or []), len(rows)
+    length = RECORD_HEAD.size + n_rows * ROW.size
+    values = [length, flags, record["id"], record["tor"], int(checksum or 0)]
+    values += (n_asks, n_rows - n_asks)
+    row_values = _row_values(rows, precision) if rows else []
+    if row_values is None:
+        return None
+    republish = len(row_values) > 3 * n_rows
+    return _record_struct(n_rows, republish).pack(*values, *row_values)
+
+
+def encode_record(record: dict, precision: tuple[int, int, int]) -> bytes:
+    """
+    record -> {"status": bool, "id": int, "data": dict, "tor": float}
+    passthrough records ("raw" instead of "data") are stored as JSON.
+    """
+    if "raw" in record:
+        body = bytes([JSON]) + encode_raw(record).encode("utf-8")
+        return LENGTH.pack(len(body)) + body
+
+    try:
+        encoded = _encode_binary(record, precision)
+    except (struct.error, TypeError, ValueError):
+        encoded = None
+    if encoded is not None:
+        return encoded
+
+    body = bytes([JSON]) + json.dumps(record).encode("utf-8")
+    return LENGTH.pack(len(body)) + body
+
+
+class FixedRows:
+    """
+    rows of one side of a binary record, read like [[price, volume,
+    timestamp(, "r")], ...]. Holds the unpacked integers, the strings are
+    built on the first read and kept.
+    """
+
+    __slots__ = ("ints", "precision", "_rows")
+
+    def __init__(self, ints: list[tuple[int, int, int, int]], precision: tuple):
+        self.ints = ints  # [(price, volume, timestamp, republish), ...] scaled
+        self.precision = precision
+        self._rows: Optional[list[list[str]]] = None
+
+    def rows(self) -> list[list[str]]:
+        if self._rows is None:
+            price_decimals, volume_decimals, timestamp_decimals = self.precision
+            rows = []
+            for price, volume, timestamp, republish in self.ints:
+                row = [
+                    from_fixed(price, price_decimals),
+                    from_fixed(volume, volume_decimals),
+                    from_fixed(timestamp, timestamp_decimals),
+                ]
+                if republish:
+                    row.append("r")
+                rows.append(row)
+            self._rows = rows
+        return self._rows
+
+    def __len__(self) -> int:
+        return len(self.ints)
+
+    def __iter__(self) -> Iterator[list[str]]:
+        return iter(self.rows())
+
+    def __getitem__(self, i):
+        return self.rows()[i]
+
+    def __eq__(self, other) -> bool:
+        other = other.rows() if isinstance(other, FixedRows) else other
+        return self.rows() == other
+
+    def __repr__(self) -> str:
+        return repr(self.rows())
+
+
+def to_plain(data: dict) -> dict:
+    """ data of a decoded record with lists instead of FixedRows (e.g. for json) """
+    return {
+        key: value.rows() if isinstance(value, FixedRows) else value
+        for key, value in data.items()
+    }
+
+
+def _decode_rows(buffer, offset: int, n: int, precision: tuple) -> FixedRows:
+    ints = list(ROW.iter_unpack(buffer[offset : offset + n * ROW.size]))
+    return FixedRows(ints, precision)
+
+
+def decode_record(buffer, offset: int, length: int, precision: tuple) -> dict:
+    if buffer[offset] & JSON:
+        record = json.loads(bytes(buffer[offset + 1 : offset + length]))
+        return decode_raw(record) if "raw" in record else record
+
+    flags, id_, tor, checksum, n_asks, n_bids = RECORD_HEAD.unpack_from(buffer, offset)
+    offset += RECORD_HEAD.size
+    ask_key, bid_key = ("as", "bs") if flags & SNAPSHOT else ("a", "b")
+
+    data = {}
+    if flags & ASKS:
+        data[ask_key] = _decode_rows(buffer, offset, n_asks, precision)
+    offset += n_asks * ROW.size
+    if flags & BIDS:
+        data[bid_key] = _decode_rows(buffer, offset, n_bids, precision)
+    if flags & CHECKSUM:
+        data["c"] = str(checksum)
+
+    return {"status": bool(flags & STATUS), "id": id_, "data": data, "tor": tor}
+
+
+def decode_records(buffer) -> Iterator[dict]:
+    """
+    decodes all complete records of a file held in buffer. A trailing
+    partial record (file is still being written) is skipped.
+    """
+    if len(buffer) < HEADER.size:
+        return
+
+    magic, *precision = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("not a binary repo file")
+
+    precision = tuple(precision)
+    offset = HEADER.size
+    while offset + LENGTH.size <= len(buffer):
+        (length,) = LENGTH.unpack_from(buffer, offset)
+        offset += LENGTH.size
+        if offset + length > len(buffer):
+            break
+        yield decode_record(buffer, offset, length, precision)
+        offset += length
+
+
+def iter_records(
+    chunks: Iterable[bytes], precision: Optional[tuple] = None
+) -> Iterator[dict]:
+    """
+    decodes records from a stream of byte chunks (see segment.iter_chunks).
+    Only the current partial record is held in memory. Pass precision
+    (see read_header) if chunks start at a record instead of the header.
+    """
+    buffer, offset = b"", 0
+    for chunk in chunks:
+        buffer = buffer[offset:] + chunk
+        offset = 0
+        if precision is None:
+            if len(buffer) < HEADER.size:
+                continue
+            magic, *precision = HEADER.unpack_from(buffer, 0)
+            if magic != MAGIC:
+                raise ValueError("not a binary repo file")
+            precision = tuple(precision)
+            offset = HEADER.size
+
+        while offset + LENGTH.size <= len(buffer):
+            (length,) = LENGTH.unpack_from(buffer, offset)
+            end = offset + LENGTH.size + length
+            if end > len(buffer):
+                break
+            yield decode_record(buffer, offset + LENGTH.size, length, precision)
+            offset = end
+
+
+def read_records(file_path: str) -> Iterator[dict]:
+    """ mmaps a binary repo file and decodes it record by record """
+    if os.path.getsize(file_path) < HEADER.size:
+        return
+
+    with open(file_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from decode_records(buffer)
@@ -1,9 +1,13 @@
+import copy
+from time import perf_counter
+from bisect import bisect_left, bisect_right
 from zlib import crc32
 
 # from termcolor import colored
 from typing import Optional
-from .utils import AssetPair
-from .repo import RepoWriter
+from .utils import AssetPair, get_decimals, to_fixed
+from .repo import REPO_WRITERS, QueuedRepoWriter
+from .raw_frame import can_pass_through
 
 
 """
@@ -16,27 +20,244 @@ The "pair_decimals" and "lot_decimals" values returned by the
 to the actual decimal precision received by orderbook updates.
 
 Therefore maintain all values in local copy of orderbook as string.
+
+Alternatively (Book(fixed_point=True)) the price precision of a pair is
+learned from its snapshot, and levels are ordered by their prices as
+integers scaled by that precision (exact, see FixedPointBookSide). No
+value is parsed as float on the update path: each price string is
+converted once, the checksum takes the integers as they are, and a zero
+volume is recognised by its digits. Prices of another precision put the
+book out of sync until the next snapshot.
 """
 
 
-def sort_dict_by_key(dic: dict, trim: int = -1, reverse: bool = False) -> dict:
-    return dict(sorted(dic.items(), key=lambda x: float(x[0]), reverse=reverse)[:trim])
+CHECKSUM_DEPTH = 10
+# fixed_point: price strings whose conversion is cached, per FixedPointBookSide
+MAX_FIXED_PRICES = 10000
 
 
 def checksum_strip(target_str: str) -> str:
     return str(int(target_str.replace(".", "")))
 
 
-def parse_checksum_str(side_dict: dict) -> str:
-    price_strs = [checksum_strip(x) for x in list(side_dict.keys())[:10]]
-    volumes = [x[1] for x in list(side_dict.values())[:10]]
-    vol_strs = [checksum_strip(x) for x in volumes]
-    return "".join([p + v for p, v in zip(price_strs, vol_strs)])
+class BookSide:
+    """
+    One side of the orderbook, kept in price order at all times.
+
+    Levels are stored in a dict keyed by the price string, next to two
+    parallel lists holding the sort keys and price strings in order.
+    Single levels are located by bisection, so an update never re-sorts
+    the whole side. Bids are kept in descending order by negating the key.
+
+    The stripped checksum token of each level is cached, and the checksum
+    input of the top levels is only rebuilt after one of them changed.
+
+    Once a numeric snapshot was taken (fill_array), volumes and timestamps
+    are kept as floats in two more parallel lists, so the next ones are
+    copied from them in one go.
+    """
+
+    def __init__(self, reverse: bool = False):
+        self.reverse = reverse
+        self._levels = {}  # {"price": ["price", "volume", "timestamp"]}
+        self._sort_keys = []
+        self._prices = []
+        self._volumes: Optional[list[float]] = None  # in price order, see fill_array
+        self._timestamps: Optional[list[float]] = None
+        self._tokens = {}  # {"price": "<stripped price><stripped volume>"}
+        self._checksum_bytes: Optional[bytes] = None
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def __contains__(self, price: str) -> bool:
+        return price in self._levels
+
+    def _sort_key(self, price: str) -> float:
+        return -float(price) if self.reverse else float(price)
+
+    def _strip(self, price: str, volume: str) -> str:
+        return checksum_strip(price) + checksum_strip(volume)
+
+    def _to_float(self, volume: str) -> float:
+        return float(volume)
 
+    def __index(self, price: str) -> int:
+        key = self._sort_key(price)
+        i = bisect_left(self._sort_keys, key)
+        # distinct price strings may share a float value ("1.0", "1.00")
+        while self._prices[i] != price:
+            i += 1
+        return i
 
-def compute_checksum(asks: dict, bids: dict) -> int:
-    checksum_str = parse_checksum_str(asks) + parse_checksum_str(bids)
-    return crc32(checksum_str.encode("utf-8"))
+    def copy(self) -> "BookSide":
+        """ rows are replaced on update, so a shallow copy of them is enough """
+        side = copy.copy(self)
+        side._levels = dict(self._levels)
+        side._sort_keys = self._sort_keys[:]
+        side._prices = self._prices[:]
+        if self._volumes is not None:
+            side._volumes = self._volumes[:]
+            side._timestamps = self._timestamps[:]
+        side._tokens = dict(self._tokens)
+        return side
+
+    def get(self, price: str) -> Optional[list[str]]:
+        return self._levels.get(price)
+
+    def __touch(self, i: int) -> None:
+        """ invalidate the cached checksum input if level i is part of it """
+        if i < CHECKSUM_DEPTH:
+            self._checksum_bytes = None
+
+    def insert(self, price: str, volume: str, timestamp: str) -> None:
+        level = self._levels.get(price)
+        if level is None:
+            key = self._sort_key(price)
+            i = bisect_right(self._sort_keys, key)
+            self._sort_keys.insert(i, key)
+            self._prices.insert(i, price)
+            if self._volumes is not None:
+                self._volumes.insert(i, self._to_float(volume))
+                self._timestamps.insert(i, float(timestamp))
+            self.__touch(i)
+        elif level[1] != volume:
+            i = self.__index(price)
+            self._tokens.pop(price, None)
+            self.__touch(i)
+            if self._volumes is not None:
+                self._volumes[i] = self._to_float(volume)
+                self._timestamps[i] = float(timestamp)
+        elif self._volumes is not None:
+            self._timestamps[self.__index(price)] = float(timestamp)
+        self._levels[price] = [price, volume, timestamp]
+
+    def remove(self, price: str) -> None:
+        if price not in self._levels:
+            return
+        i = self.__index(price)
+        del self._sort_keys[i]
+        del self._prices[i]
+        if self._volumes is not None:
+            del self._volumes[i]
+            del self._timestamps[i]
+        self._levels.pop(price)
+        self._tokens.pop(price, None)
+        self.__touch(i)
+
+    def truncate(self, depth: int) -> None:
+        """ drop all levels beyond depth """
+        if len(self._prices) <= depth:
+            return
+        for price in self._prices[depth:]:
+            self._levels.pop(price)
+            self._tokens.pop(price, None)
+        del self._sort_keys[depth:]
+        del self._prices[depth:]
+        if self._volumes is not None:
+            del self._volumes[depth:]
+            del self._timestamps[depth:]
+        self.__touch(depth)
+
+    def __token(self, price: str) -> str:
+        token = self._tokens.get(price)
+        if token is None:
+            token = self._strip(price, self._levels[price][1])
+            self._tokens[price] = token
+        return token
+
+    def checksum_bytes(self) -> bytes:
+        """ checksum input of the top CHECKSUM_DEPTH levels """
+        if self._checksum_bytes is None:
+            tokens = [self.__token(p) for p in self._prices[:CHECKSUM_DEPTH]]
+            self._checksum_bytes = "".join(tokens).encode("utf-8")
+        return self._checksum_bytes
+
+    def keys(self) -> list[str]:
+        return self._prices[:]
+
+    def values(self) -> list[list[str]]:
+        return [self._levels[price] for price in self._prices]
+
+    def snapshot(self, depth: int = -1) -> list[list[float]]:
+        return [[float(y) for y in row] for row in self.values()[:depth]]
+
+    def fill_array(self, out) -> int:
+        """
+        writes the top len(out) levels into the float array out (shape [n, 3])
+        and returns the number of rows written.
+        """
+        if self._volumes is None:
+            # kept up to date from now on
+            rows = [self._levels[price] for price in self._prices]
+            self._volumes = [self._to_float(row[1]) for row in rows]
+            self._timestamps = [float(row[2]) for row in rows]
+
+        n = min(len(out), len(self._prices))
+        out[:n, 0] = self._sort_keys[:n]
+        if self.reverse:
+            out[:n, 0] *= -1
+        out[:n, 1] = self._volumes[:n]
+        out[:n, 2] = self._timestamps[:n]
+        return n
+
+    def best_price(self) -> Optional[float]:
+        """ price of the best level, None if empty """
+        if not self._sort_keys:
+            return None
+        key = self._sort_keys[0]
+        return float(-key if self.reverse else key)
+
+
+class FixedPointBookSide(BookSide):
+    """
+    BookSide ordered by prices as scaled integers, converted once per price
+    string (see fixed_price). Levels are kept as received, volumes of any
+    precision.
+
+    Kraken's checksum strips the decimal point and leading zeros, which is
+    exactly str() of the scaled price.
+    """
+
+    def __init__(self, price_decimals: int, volume_decimals: int, reverse=False):
+        super(FixedPointBookSide, self).__init__(reverse)
+        self.price_decimals = price_decimals
+        self.volume_decimals = volume_decimals
+        self._fixed_prices: dict[str, int] = {}
+
+    def fixed_price(self, price: str) -> int:
+        """ raises ValueError if price does not have price_decimals decimals """
+        fixed = self._fixed_prices.get(price)
+        if fixed is None:
+            fixed = to_fixed(price, self.price_decimals)
+            if fixed is None:
+                raise ValueError(f"not {self.price_decimals} decimals: {price}")
+            if len(self._fixed_prices) >= MAX_FIXED_PRICES:
+                self._fixed_prices.clear()
+            self._fixed_prices[price] = fixed
+        return fixed
+
+    def _sort_key(self, price: str) -> int:
+        fixed = self._fixed_prices.get(price)
+        if fixed is None:
+            fixed = self.fixed_price(price)
+        return -fixed if self.reverse else fixed
+
+    def _strip(self, price: str, volume: str) -> str:
+        return str(self.fixed_price(price)) + checksum_strip(volume)
+
+    def fill_array(self, out) -> int:
+        n = super(FixedPointBookSide, self).fill_array(out)
+        out[:n, 0] /= 10 ** self.price_decimals
+        return n
+
+    def best_price(self) -> Optional[float]:
+        price = super(FixedPointBookSide, self).best_price()
+        return None if price is None else price / 10 ** self.price_decimals
+
+
+def compute_checksum(asks: BookSide, bids: BookSide) -> int:
+    return crc32(bids.checksum_bytes(), crc32(asks.checksum_bytes()))
 
 
 class Book:
@@ -57,58 +278,99 @@ class Book:
         assetPair: AssetPair,
         depth: int = 10,
         data_dir: Optional[str] = None,
+        fixed_point: bool = False,
+        record_format: str = "jsonl",
+        writer_stage=None,
+        writer_kwargs: Optional[dict] = None,
     ):
         self.name = f"BOOK{depth}"
         self.exchange = "KRAKEN"
         self.assetPair = assetPair
         self.depth = depth
         self.insync = True
-        self.asks = {}  # {"price": ["price", "volume", "timestamp"]}
-        self.bids = {}
+        self.fixed_point = fixed_point
+        self.price_decimals: Optional[int] = None
+        self.volume_decimals: Optional[int] = None
+        self.asks, self.bids = self.__new_sides()
         self.n_times_out_of_sync = 0
         self.update_id = 0
+        self.lag: Optional[float] = None  # live: exchange timestamp -> applied
+        self.stats = None  # live: PairStats, see stats
+        self.__precision_error = False
 
         self.repoWriter = None
         if data_dir:
-            self.repoWriter = RepoWriter(
-                self.exchange, self.name, self.assetPair.name, data_dir
+            self.repoWriter = REPO_WRITERS[record_format](
+                self.exchange,
+                self.name,
+                self.assetPair.name,
+                data_dir,
+                **(writer_kwargs or {}),
             )
+            if writer_stage is not None:
+                self.repoWriter = QueuedRepoWriter(self.repoWriter, writer_stage)
+
+    def __new_sides(self) -> tuple[BookSide, BookSide]:
+        if not self.fixed_point or self.price_decimals is None:
+            return BookSide(), BookSide(reverse=True)
+
+        pd, vd = self.price_decimals, self.volume_decimals
+        return FixedPointBookSide(pd, vd), FixedPointBookSide(pd, vd, reverse=True)
+
+    def __learn_precision(self, side_data: Optional[list[list[str]]]) -> None:
+        if side_data:
+            self.price_decimals = get_decimals(side_data[0][0])
+            self.volume_decimals = get_decimals(side_data[0][1])
 
     def __insert_delete(
         self, side: str, price: str, volume: str, timestamp: str
     ) -> None:
         if float(volume) != 0.0:
-            self.__dict__[side].update({price: [price, volume, timestamp]})
-        elif self.__dict__[side].get(price) is not None:
-            self.__dict__[side].pop(price)
+            self.__dict__[side].insert(price, volume, timestamp)
         else:
-            pass
+            self.__dict__[side].remove(price)
 
-    def __sort_side(self, side: str) -> None:
-        reverse = side == "bids"
-        self.__dict__[side] = sort_dict_by_key(self.__dict__[side], self.depth, reverse)
+    def __trim_side(self, side: str) -> None:
+        self.__dict__[side].truncate(self.depth)
 
     def __update_row(self, side: str, row: list[str]) -> None:
         price, volume, timestamp = row[:3]
         self.__insert_delete(side, price, volume, timestamp)
 
+    def __update_book_fixed(self, side: str, side_data: list[list[str]]) -> None:
+        bookSide = self.__dict__[side]
+        insert, remove = bookSide.insert, bookSide.remove
+        for row in side_data:
+            if not row[1].lstrip("0."):
+                remove(row[0])  # volume 0
+                continue
+            try:
+                insert(row[0], row[1], row[2])
+            except ValueError:
+                # precision changed, wait for a new snapshot
+                self.__precision_error = True
+
     def __update_book(self, side: str, side_data: list[list[str]]) -> None:
         """ side_data -> [[price, volume, timestamp], ...] """
-        for row in side_data:
-            self.__update_row(side, row)
-        self.__sort_side(side)
+        if self.price_decimals is not None:
+            self.__update_book_fixed(side, side_data)
+        else:
+            for row in side_data:
+                self.__update_row(side, row)
+        self.__trim_side(side)
 
-    def parse_ws_data(self, data: dict) -> None:
-        self.update_id += 1
+    def __apply(self, data: dict) -> bool:
+        """ applies a ws update, returns False if it holds neither side """
         asks = data.get("as") or data.get("a")
         bids = data.get("bs") or data.get("b")
-        checksum = data.get("c")
 
         is_snapshot = data.get("as") is not None
         if is_snapshot:
             self.insync = True
-            self.asks = {}
-            self.bids = {}
+            self.__precision_error = False
+            if self.fixed_point:
+                self.__learn_precision(asks or bids)
+            self.asks, self.bids = self.__new_sides()
 
         if asks is not None:
             self.__update_book("asks", asks)
@@ -116,21 +378,174 @@ class Book:
         if bids is not None:
             self.__update_book("bids", bids)
 
+        return asks is not None or bids is not None
+
+    def __is_valid(self, checksum: str) -> bool:
+        valid = int(checksum) == compute_checksum(self.asks, self.bids)
+        return valid and not self.__precision_error
+
+    def __get_state(self) -> tuple:
+        precision = (self.price_decimals, self.volume_decimals)
+        return self.asks.copy(), self.bids.copy(), precision, self.__precision_error
+
+    def __set_state(self, state: tuple) -> None:
+        self.asks, self.bids, precision, self.__precision_error = state
+        self.price_decimals, self.volume_decimals = precision
+
+    def apply_batch(self, batch: list[dict]) -> Optional[int]:
+        """
+        applies a sequence of ws updates (as passed to parse_ws_data) for
+        replay. The checksum is only verified after the last message of
+        the batch that carries one. Nothing is written to the repo.
+
+        returns None when in sync, otherwise the index of the first message
+        in batch whose checksum failed. Only batches with a checksum change
+        insync, n_times_out_of_sync counts those that lose it.
+        """
+        was_insync = self.insync
+        last = len(batch) - 1
+        while last >= 0 and batch[last].get("c") is None:
+            last -= 1
+
+        state = self.__get_state() if last >= 0 else None
+        for data in batch[: last + 1]:
+            self.__apply(data)
+
+        failed = None
+        if last >= 0 and not self.__is_valid(batch[last]["c"]):
+            # replay the checked part message by message to locate the failure
+            self.__set_state(state)
+            for i, data in enumerate(batch[: last + 1]):
+                self.__apply(data)
+                checksum = data.get("c")
+                if failed is None and checksum and not self.__is_valid(checksum):
+                    failed = i
+
+        if last >= 0:
+            self.insync = failed is None
+
+        for data in batch[last + 1 :]:
+            self.__apply(data)
+
+        self.update_id += len(batch)
+        if was_insync and not self.insync:
+            self.n_times_out_of_sync += 1
+        return failed
+
+    def parse_ws_data(self, data: dict, raw: Optional[str] = None) -> None:
+        """
+        raw: the frame that data was decoded from. If given, it is recorded
+        as is instead of data (see raw_frame), unless a snapshot is attached.
+        """
+        self.update_id += 1
+        stats = self.stats
+        start = perf_counter() if stats is not None else 0.0
+        has_data = self.__apply(data)
+        checksum = data.get("c")
+        if stats is not None:
+            applied = perf_counter()
+            stats.apply.add(applied - start)
+
         if checksum is not None:
             self.insync = int(checksum) == compute_checksum(self.asks, self.bids)
             if not self.insync:
                 self.n_times_out_of_sync += 1
+            if stats is not None:
+                stats.checksum.add(perf_counter() - applied)
+
+        if self.__precision_error and self.insync:
+            self.insync = False
+            self.n_times_out_of_sync += 1
 
         if self.repoWriter is not None:
-            # when starting a new file, always attach snapshot of full orderbook
-            if not self.repoWriter.is_current_period():
-                data = {"as": list(self.asks.values()), "bs": list(self.bids.values())}
+            start = perf_counter() if stats is not None else 0.0
+            self.__record(data, raw)
+            if stats is not None:
+                stats.write.add(perf_counter() - start)
 
+        if not has_data:
+            print("mistake!")
+
+    def __record(self, data: dict, raw: Optional[str] = None) -> None:
+        # when starting a new file (or at a checkpoint), attach full orderbook
+        if self.repoWriter.needs_snapshot():
+            data = {"as": list(self.asks.values()), "bs": list(self.bids.values())}
+            raw = None
+
+        if raw is not None and can_pass_through(raw):
+            data = {"status": self.insync, "id": self.update_id, "raw": raw}
+        else:
             data = {"status": self.insync, "id": self.update_id, "data": data}
-            self.repoWriter.write_line(data)
+        self.repoWriter.write_line(data)
 
-        if bids is None and asks is None:
-            print("mistake!")
+    def parse_ws_batch(
+        self, batch: list[dict], raws: Optional[list[Optional[str]]] = None
+    ) -> None:
+        """
+        parses a run of ws updates of the book in one go (see coalescer):
+        only the checksum of the last one is verified, and all of them are
+        recorded as received, with that outcome as status.
+        Books that are out of sync already parse them one by one.
+        """
+        raws = raws or [None] * len(batch)
+        checksum = batch[-1].get("c")
+        if len(batch) == 1 or not self.insync or checksum is None:
+            for data, raw in zip(batch, raws):
+                self.parse_ws_data(data, raw)
+            return
+
+        n, stats = len(batch), self.stats
+        start = perf_counter() if stats is not None else 0.0
+        for data in batch:
+            self.__apply(data)
+        if stats is not None:
+            applied = perf_counter()
+            stats.apply.add((applied - start) / n, n)
+
+        self.insync = self.__is_valid(checksum)
+        if not self.insync:
+            self.n_times_out_of_sync += 1
+        if stats is not None:
+            checked = perf_counter()
+            stats.checksum.add(checked - applied)
+
+        self.__record_batch(batch, raws)
+        if stats is not None and self.repoWriter is not None:
+            stats.write.add((perf_counter() - checked) / n, n)
+
+    def __record_batch(self, batch: list[dict], raws: list[Optional[str]]) -> None:
+        if self.repoWriter is None:
+            self.update_id += len(batch)
+            return
+
+        for i, (data, raw) in enumerate(zip(batch, raws)):
+            if self.repoWriter.needs_snapshot():
+                # the levels are the ones after the batch, the snapshot stands
+                # for the rest of it
+                self.update_id += len(batch) - i
+                self.__record(data)
+                return
+            self.update_id += 1
+            self.__record(data, raw)
+
+    def take_over(self, other: "Book", n_updates: int = 0) -> None:
+        """
+        replaces the levels by the ones of other (a book of the same pair that
+        is insync, see resync), and records them as one snapshot marked with
+        "resync". n_updates: updates that were received meanwhile, but not
+        recorded one by one.
+        """
+        self.asks, self.bids = other.asks, other.bids
+        self.price_decimals = other.price_decimals
+        self.volume_decimals = other.volume_decimals
+        self.__precision_error = False
+        self.insync = other.insync
+        self.update_id += n_updates
+
+        if self.repoWriter is not None:
+            data = {"as": list(self.asks.values()), "bs": list(self.bids.values())}
+            record = {"status": self.insync, "id": self.update_id, "data": data}
+            self.repoWriter.write_line({**record, "resync": True})
 
     def get_snapshot(self, side: str, depth: int = -1) -> list[list[float]]:
         """
@@ -139,10 +554,15 @@ class Book:
         bids: highest price -> lowest price
         e.g: [[price, volume, timestamp], [...], ...]
         """
-        # x = [
-        # [float(x) for x in row.values()]
-        # for row in list(self.__dict__[side].values())[:depth]
-        # ]
-        x = list(self.__dict__[side].values())
-        x = [[float(y) for y in row] for row in x[:depth]]
-        return x
+        return self.__dict__[side].snapshot(depth)
+
+    def fill_snapshot(self, side: str, out) -> int:
+        """
+        same ordering as get_snapshot, but writes into a preallocated
+        float array of shape [depth, 3]. see book_arrays.BookArrays
+        """
+        return self.__dict__[side].fill_array(out)
+
+    def best_price(self, side: str) -> Optional[float]:
+        """ price of the best offer of side, None if it is empty """
+        return self.__dict__[side].best_price()
@@ -0,0 +1,85 @@
+import numpy as np
+from typing import Optional
+from .book import Book
+
+
+"""
+Vectorized depth analytics on top of Book.
+
+levels arrays have shape [n, 3] with columns [price, volume, timestamp],
+sorted from best offer to worst offer (see Book.get_snapshot).
+"""
+
+PRICE, VOLUME, TIMESTAMP = 0, 1, 2
+
+
+def cumulative_depth(levels: np.ndarray) -> np.ndarray:
+    """ cumulative volume from the best level outwards """
+    return np.cumsum(levels[:, VOLUME])
+
+
+def vwap(levels: np.ndarray, size: float) -> float:
+    """
+    volume weighted average price of filling "size" against levels.
+    returns nan if the levels do not hold enough volume.
+    """
+    volumes = levels[:, VOLUME]
+    cum = np.cumsum(volumes)
+    if len(cum) == 0 or cum[-1] < size:
+        return np.nan
+
+    filled = np.clip(size - (cum - volumes), 0.0, volumes)
+    return float(np.dot(levels[:, PRICE], filled) / size)
+
+
+def imbalance(asks: np.ndarray, bids: np.ndarray) -> float:
+    """ (bid volume - ask volume) / (bid volume + ask volume), in [-1, 1] """
+    ask_volume = asks[:, VOLUME].sum()
+    bid_volume = bids[:, VOLUME].sum()
+    total = ask_volume + bid_volume
+    return float((bid_volume - ask_volume) / total) if total else np.nan
+
+
+class BookArrays:
+    """
+    ndarray snapshots of a Book with preallocated buffers.
+
+    IMPORTANT:
+    arrays returned by snapshot() are views into the buffers, and are
+    overwritten by the next call. Copy them to keep them around.
+    """
+
+    def __init__(self, book: Book, n_levels: Optional[int] = None):
+        self.book = book
+        self.n_levels = n_levels or book.depth
+        self.__buffers = {
+            "asks": np.zeros((self.n_levels, 3)),
+            "bids": np.zeros((self.n_levels, 3)),
+        }
+
+    def snapshot(self, side: str, n_levels: Optional[int] = None) -> np.ndarray:
+        buffer = self.__buffers[side][: n_levels or self.n_levels]
+        n = self.book.fill_snapshot(side, buffer)
+        return buffer[:n]
+
+    def best(self, side: str) -> float:
+        price = self.book.best_price(side)
+        return np.nan if price is None else price
+
+    def mid_price(self) -> float:
+        return (self.best("asks") + self.best("bids")) / 2
+
+    def spread(self) -> float:
+        return self.best("asks") - self.best("bids")
+
+    def cumulative_depth(self, side: str, n_levels: Optional[int] = None):
+        return cumulative_depth(self.snapshot(side, n_levels))
+
+    def vwap(self, side: str, size: float, n_levels: Optional[int] = None) -> float:
+        """ side "asks" -> buying "size", side "bids" -> selling "size" """
+        return vwap(self.snapshot(side, n_levels), size)
+
+    def imbalance(self, n_levels: Optional[int] = None) -> float:
+        asks = self.snapshot("asks", n_levels)
+        bids = self.snapshot("bids", n_levels)
+        return imbalance(asks, bids)
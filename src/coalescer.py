@@ -0,0 +1,83 @@
+import asyncio
+from typing import Any, Callable, Optional
+
+
+"""
+Coalescing stage between WSAPI and Book, for a consumer that falls behind.
+
+Instead of handling every update of a channel on its own, the updates
+are collected while more of them are waiting, and handed over as one
+batch (see handle_book_batch in live_feed). Book.parse_ws_batch applies a
+batch in one go and verifies only the checksum of its last update, but
+records every update as received. A lagging consumer thus catches up in
+bursts. The price: a gap is only noticed at the end of its batch, and all
+updates of that batch are recorded out of sync.
+
+A batch ends when nothing is waiting anymore:
+threaded WSAPI: after each dispatch pass over the ingest buffer (flush)
+asyncio:        once the event loop runs out of received messages
+or when it holds maxBatch updates.
+
+conf["wsapi"]["coalesce"]: {"enabled": false, "maxBatch": 100}
+"""
+
+BatchHandler = Callable[[list[tuple[list, Optional[str]]]], None]
+
+
+class Coalescer:
+    def __init__(self, max_batch: int = 100, use_asyncio: bool = False):
+        self.max_batch = max_batch
+        self.use_asyncio = use_asyncio
+        self.n_batches = 0
+        self.n_updates = 0
+
+        # (handler, pending updates) by channel
+        self.__channels: list[tuple[BatchHandler, list]] = []
+        self.__scheduled = False
+
+    @classmethod
+    def from_conf(
+        cls, conf: dict[str, Any], use_asyncio: bool = False
+    ) -> "Coalescer":
+        return cls(max_batch=conf.get("maxBatch", 100), use_asyncio=use_asyncio)
+
+    def get_handler(
+        self, handle_batch: BatchHandler, keep_raw: bool = False
+    ) -> Callable[[list, str], None]:
+        """
+        handler for WSAPI.set_handler, that collects the updates of one
+        channel for handle_batch([(data, raw), ...]). keep_raw: passthrough
+        """
+        channel = (handle_batch, [])
+        self.__channels.append(channel)
+
+        def handle(data: list, raw: str):
+            pending = channel[1]
+            pending.append((data, raw if keep_raw else None))
+            if len(pending) >= self.max_batch:
+                self.__flush(channel)
+            elif self.use_asyncio and not self.__scheduled:
+                # runs after the messages that are ready already
+                asyncio.get_running_loop().call_soon(self.flush)
+                self.__scheduled = True
+
+        return handle
+
+    def __flush(self, channel: tuple[BatchHandler, list]) -> None:
+        handle_batch, pending = channel
+        if not pending:
+            return
+        batch = pending[:]
+        pending.clear()
+        self.n_batches += 1
+        self.n_updates += len(batch)
+        handle_batch(batch)
+
+    def flush(self) -> None:
+        """ hands over the pending updates of all channels """
+        self.__scheduled = False
+        for channel in self.__channels:
+            self.__flush(channel)
+
+    def mean_batch(self) -> float:
+        return self.n_updates / self.n_batches if self.n_batches else 0.0
@@ -0,0 +1,138 @@
+import os
+import shutil
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Optional
+from .repo import RepoReader, RotationPolicy, read_file
+from .segment import ZIP_SUFFIX, get_codec, strip_container_suffix
+from .utils import AssetPair
+
+
+"""
+Columnar copy of the repo archives, for research.
+
+Every archive (KRAKEN_BOOK100_<pair>_<ts>.zip, or a closed .gz/.xz
+segment) is converted once into a directory
+<out_dir>/KRAKEN_BOOK100_<pair>_<ts>.cols with one .npy file per column
+and one row per price level of a record:
+
+update_id, tor, status, snapshot: of the record
+side:                             ASK or BID
+price, volume, timestamp:         of the level
+republish:                        "r" flag of the level
+
+load_columns mmaps them. Archives that already have a directory are
+skipped, so convert_repo can be re-run after every rotation.
+
+conf["columnar"]: {"outDir": "columns", "workers": null}
+"""
+
+ASK, BID = 0, 1
+COLUMNS = {
+    "update_id": np.int64,
+    "tor": np.float64,
+    "status": np.bool_,
+    "snapshot": np.bool_,
+    "side": np.int8,
+    "price": np.float64,
+    "volume": np.float64,
+    "timestamp": np.float64,
+    "republish": np.bool_,
+}
+COLUMNS_SUFFIX = ".cols"
+
+
+def get_columns_path(out_dir: str, file_path: str) -> str:
+    file_name = os.path.basename(strip_container_suffix(file_path))
+    return os.path.join(out_dir, file_name + COLUMNS_SUFFIX)
+
+
+def convert_file(file_path: str, columns_path: str) -> int:
+    """ converts one archive, returns the number of rows """
+    columns = {name: [] for name in COLUMNS}
+    for data in read_file(file_path):
+        book_data = data["data"]
+        snapshot = "as" in book_data or "bs" in book_data
+        for side, keys in ((ASK, ("as", "a")), (BID, ("bs", "b"))):
+            for level in book_data.get(keys[0], book_data.get(keys[1], [])):
+                columns["update_id"].append(data["id"])
+                columns["tor"].append(data["tor"])
+                columns["status"].append(data["status"])
+                columns["snapshot"].append(snapshot)
+                columns["side"].append(side)
+                columns["price"].append(float(level[0]))
+                columns["volume"].append(float(level[1]))
+                columns["timestamp"].append(float(level[2]))
+                columns["republish"].append(len(level) > 3)
+
+    # write next to the target and rename, so a directory is always complete
+    tmp_path = columns_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(tmp_path, name), np.array(columns[name], dtype=dtype))
+    os.rename(tmp_path, columns_path)
+    return len(columns["update_id"])
+
+
+def load_columns(columns_path: str) -> dict[str, np.ndarray]:
+    """ read only, memory mapped columns of a converted archive """
+    return {
+        name: np.load(os.path.join(columns_path, name + ".npy"), mmap_mode="r")
+        for name in COLUMNS
+    }
+
+
+def get_new_archives(
+    conf: dict[str, Any], assetPairs: list[AssetPair], out_dir: str
+) -> list[str]:
+    """
+    archives (closed files) of all pairs that were not converted yet.
+    Segments count as closed once the period after theirs is over as well:
+    RepoWriter moves on at the first record of a new period.
+    """
+    depth = conf["repo"]["depth"]
+    data_dir = conf["repo"]["dataDir"]
+    rotation = RotationPolicy.from_conf(conf["repo"].get("rotation", {}))
+    closed_before = rotation.get_period() - rotation.interval
+
+    file_paths = []
+    for assetPair in assetPairs:
+        repoReader = RepoReader("KRAKEN", f"BOOK{depth}", assetPair.name, data_dir)
+        for file_path in repoReader.file_paths:
+            if get_codec(file_path) is not None:
+                if repoReader.get_file_period(file_path) >= closed_before:
+                    continue  # might still be written
+            elif not file_path.endswith(ZIP_SUFFIX):
+                continue  # still being written
+            if not os.path.exists(get_columns_path(out_dir, file_path)):
+                file_paths.append(file_path)
+    return file_paths
+
+
+def convert_repo(
+    conf: dict[str, Any],
+    assetPairs: list[AssetPair],
+    out_dir: str,
+    workers: Optional[int] = None,
+) -> dict[str, int]:
+    """
+    converts all new archives in a process pool (workers: number of
+    processes, default os.cpu_count()). returns {columns path: rows}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    file_paths = get_new_archives(conf, assetPairs, out_dir)
+    file_paths.sort(key=os.path.getsize, reverse=True)  # balance the pool
+
+    converted = {}
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {}
+        for file_path in file_paths:
+            columns_path = get_columns_path(out_dir, file_path)
+            future = executor.submit(convert_file, file_path, columns_path)
+            futures[future] = columns_path
+
+        for future in as_completed(futures):
+            converted[futures[future]] = future.result()
+            print(f"converted: {futures[future]}")
+    return converted
@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Iterator, Optional
 
 import sys
 import time
@@ -8,7 +8,7 @@ from termcolor import colored
 # from datetime import datetime
 from .utils import AssetInfo, AssetPair
 from .book import Book
-from .repo import RepoReader
+from .repo import RepoReader, MergedRepoReader
 
 
 def handle_data_feed(data: dict[str, Any], book: Book):
@@ -40,15 +40,64 @@ class DataFeed:
         depth = conf["repo"]["depth"]
         stream_name = f"BOOK{depth}"
         data_dir = conf["repo"]["dataDir"]
+        fixed_point = conf["repo"].get("fixedPoint", False)
+
+        # small read-ahead per pair, so that merging dozens of pairs stays cheap
+        read_ahead = {"max_chunks": 2, "chunk_size": 1 << 18}
+        self.repoReaders = {
+            p.name: RepoReader(exchange, stream_name, p.name, data_dir, **read_ahead)
+            for p in assetPairs
+        }
+        self.books = {p.name: Book(p, depth, None, fixed_point) for p in assetPairs}
+        self.mergedReader = MergedRepoReader(self.repoReaders)
 
         assetPair = assetPairs[0]
-        self.repoReader = RepoReader(exchange, stream_name, assetPair.name, data_dir)
-        self.book = Book(assetPair, depth, None)
+        self.repoReader = self.repoReaders[assetPair.name]
+        self.book = self.books[assetPair.name]
+
+    def feed(self, start_ts: Optional[float] = None):
+        """ start_ts: skip to the book at this time of recording (see seek) """
+        records = self.repoReader.data_generator()
+        if start_ts is not None:
+            records = self.repoReader.seek(start_ts, self.book)
 
-    def feed(self):
-        for i, data in enumerate(self.repoReader.data_generator()):
+        for i, data in enumerate(records):
 
             handle_data_feed(data, self.book)
             log_order_book(data, self.book)
 
         time.sleep(0.5)
+
+    def merged_feed(
+        self, start_ts: Optional[float] = None
+    ) -> Iterator[tuple[str, dict[str, Any], Book]]:
+        """
+        applies the records of all pairs in time of recording order to
+        the book of their pair. yields (pair name, record, book) after each.
+        """
+        records = self.mergedReader.data_generator()
+        if start_ts is not None:
+            records = self.mergedReader.seek(start_ts, self.books)
+
+        for pair_name, data in records:
+            book = self.books[pair_name]
+            handle_data_feed(data, book)
+            yield pair_name, data, book
+
+    def __apply_batch(self, batch: list[dict[str, Any]]):
+        failed = self.book.apply_batch([data["data"] for data in batch])
+        if failed is not None:
+            print(colored(f"_RE_ id: {batch[failed]['id']}", "red"))
+
+    def replay(self, batch_size: int = 1000):
+        """ rebuilds the book as fast as possible, without logging every update """
+        batch = []
+        for data in self.repoReader.data_generator():
+            batch.append(data)
+            if len(batch) == batch_size:
+                self.__apply_batch(batch)
+                batch = []
+
+        if batch:
+            self.__apply_batch(batch)
+        print(self.repoReader.stats())
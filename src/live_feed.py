@@ -1,30 +1,119 @@
-import sys
-from typing import Any
-from termcolor import colored
+import asyncio
+from functools import partial
+from typing import Any, Callable, Optional
 
 import time
 from .book import Book
+from .coalescer import Coalescer
+from .repo import RotationPolicy, CheckpointPolicy
+from .resync import Resync
+from .stats import LiveStats
 from .utils import AssetPair
+from .writer_stage import WriterStage
 
 # from crypto_apis.kraken import WSAPI
 from .wsapi import WSAPI
+from .wsapi.decoders import get_book_data
 
 
-def handle_ws_feed(wsapi: WSAPI, books: dict[int, Book]):
-    for subscription_id, data in wsapi.listen_gen():
-        book = books.get(subscription_id)
+def handle_book_message(
+    wsapi: WSAPI,
+    book: Book,
+    subscription_id: int,
+    data: list,
+    raw: Optional[str],
+    resync: Optional[Resync] = None,
+):
+    # raw: record the frame as received (passthrough), see raw_frame
+    book_data = get_book_data(data)
+    if resync is not None and resync.is_resyncing(book):
+        resync.on_update(book, book_data)
+        return
 
-        if book is None:
-            raise ValueError(f"CANNOT FIND BOOK, subscription_id: {subscription_id}")
+    book.parse_ws_data(book_data, raw)
+    book.lag = get_lag(book_data)
+    check_sync(wsapi, book, subscription_id, book_data, resync)
 
-        book.parse_ws_data(data[1])
-        if "BOOK" in book.name and not book.insync:
-            wsapi.resubscribe_public(subscription_id)
-            print(colored("_RE_", "red"), end="")
-        elif "BOOK" in book.name:
-            print(colored("X", "green"), end="")
 
-        sys.stdout.flush()
+def handle_book_batch(
+    wsapi: WSAPI,
+    book: Book,
+    subscription_id: int,
+    batch: list[tuple[list, Optional[str]]],
+    resync: Optional[Resync] = None,
+):
+    """ updates of the channel that were waiting together, see coalescer """
+    batch_data = [get_book_data(data) for data, _ in batch]
+    raws = [raw for _, raw in batch]
+    while resync is not None and resync.is_resyncing(book) and batch_data:
+        resync.on_update(book, batch_data.pop(0))
+        raws.pop(0)
+    if not batch_data:
+        return
+
+    book.parse_ws_batch(batch_data, raws)
+    book.lag = get_lag(batch_data[-1])
+    check_sync(wsapi, book, subscription_id, batch_data[-1], resync)
+
+
+def check_sync(
+    wsapi: WSAPI,
+    book: Book,
+    subscription_id: int,
+    book_data: dict,
+    resync: Optional[Resync] = None,
+):
+    """ book_data: the update applied last """
+    if "BOOK" not in book.name or book.insync:
+        return
+
+    if resync is not None:
+        # on a secondary connection, while this one keeps streaming
+        fallback = partial(wsapi.resubscribe_public, subscription_id)
+        resync.start(book, book_data, fallback)
+        if book.stats is not None:
+            book.stats.resyncs += 1
+    else:
+        wsapi.resubscribe_public(subscription_id)
+        if book.stats is not None:
+            book.stats.resubscribes += 1
+
+
+def get_lag(data: dict) -> Optional[float]:
+    """ seconds from the latest exchange timestamp of an update to now """
+    timestamps = [float(row[2]) for row in data.get("a", []) + data.get("b", [])]
+    return time.time() - max(timestamps) if timestamps else None
+
+
+def get_book_handler(
+    wsapi: WSAPI,
+    book: Book,
+    subscription_id: int,
+    passthrough: bool = False,
+    resync: Optional[Resync] = None,
+    coalescer: Optional[Coalescer] = None,
+) -> Callable[[list, str], None]:
+    """ handler for WSAPI.set_handler, updates of the channel go straight to book """
+
+    def handle(data: list, raw: str):
+        raw = raw if passthrough else None
+        handle_book_message(wsapi, book, subscription_id, data, raw, resync)
+
+    handler = handle
+    if coalescer is not None:
+        handle_batch = partial(
+            handle_book_batch, wsapi, book, subscription_id, resync=resync
+        )
+        handler = coalescer.get_handler(handle_batch, keep_raw=passthrough)
+    if book.stats is None:
+        return handler
+
+    def handle_counted(data: list, raw: str):
+        book.stats.messages += 1
+        book.stats.decode.add(wsapi.decode_time)
+        handler(data, raw)
+
+    return handle_counted
 
 
 def subscribe(wsapi: WSAPI, depth: int, assetPair: AssetPair) -> int:
@@ -40,26 +129,169 @@ class LiveFeed:
         assetPairs: list[AssetPair],
         save_to_repo: bool = True,
     ):
-        self.wsapi = WSAPI()
+        # event driven client instead of polling a thread, conf["wsapi"]
+        wsapi_conf = conf.get("wsapi", {})
+        self.use_asyncio = wsapi_conf.get("asyncio", False)
+        decoder = wsapi_conf.get("decoder", "auto")
+        api_domain = wsapi_conf.get("apiDomain")  # None: kraken
+        ingest_conf = wsapi_conf.get("ingest", {})
+        ingest = (ingest_conf.get("capacity"), ingest_conf.get("overload", "block"))
+        if self.use_asyncio:
+            from .wsapi.wsapi_async import AsyncWSAPI  # needs websockets
+
+            WSAPIClass = AsyncWSAPI
+        else:
+            WSAPIClass = WSAPI
+        self.wsapi = WSAPIClass(decoder, api_domain, *ingest)
+        self.wsapis = [self.wsapi]
 
         depth = conf["repo"]["depth"]
+        # resync out of sync books on a secondary connection, see resync
+        self.resync = None
+        resync_conf = wsapi_conf.get("resync", {})
+        if resync_conf.get("secondary", False):
+            secondary = WSAPIClass(decoder, api_domain, *ingest)
+            self.resync = Resync.from_conf(secondary, depth, resync_conf)
+            self.wsapis.append(secondary)
+
+        # merge the updates a channel has waiting, see coalescer
+        self.coalescer = None
+        coalesce_conf = wsapi_conf.get("coalesce", {})
+        if coalesce_conf.get("enabled", False):
+            self.coalescer = Coalescer.from_conf(coalesce_conf, self.use_asyncio)
+
         data_dir = conf["repo"]["dataDir"] if save_to_repo else None
+        fixed_point = conf["repo"].get("fixedPoint", False)
+        record_format = conf["repo"].get("recordFormat", "jsonl")
+        self.passthrough = conf["repo"].get("passthrough", False)
+        rotation_conf = conf["repo"].get("rotation", {})
+        checkpoint_conf = conf["repo"].get("checkpoint", {})
+        writer_kwargs = {
+            "rotation": RotationPolicy.from_conf(rotation_conf),
+            "compression": conf["repo"].get("compression"),
+            "checkpoint": CheckpointPolicy.from_conf(checkpoint_conf),
+        }
+
+        self.writerStage = None
+        writer_conf = conf["repo"].get("writer", {})
+        if save_to_repo and writer_conf.get("background", False):
+            self.writerStage = WriterStage.from_conf(writer_conf)
+            self.writerStage.start()
+
         self.books: dict[int, Book] = {
-            subscribe(self.wsapi, depth, assetPair): Book(assetPair, depth, data_dir)
+            subscribe(self.wsapi, depth, assetPair): Book(
+                assetPair,
+                depth,
+                data_dir,
+                fixed_point,
+                record_format,
+                self.writerStage,
+                writer_kwargs,
+            )
             for assetPair in assetPairs
         }
+        # periodic summaries and dumps, see stats
+        self.stats = LiveStats.from_conf(conf.get("stats", {}))
+        self.stats.sources["ingest"] = self.ingest_stats
+        if self.resync is not None:
+            self.stats.sources["resync"] = self.resync.counts
+        if self.coalescer is not None:
+            self.stats.sources["mean_batch"] = self.coalescer.mean_batch
+        if self.writerStage is not None:
+            self.stats.sources["writer"] = self.writerStage.stats
+        for book in self.books.values():
+            self.stats.add_book(book)
 
-    def feed(self):
-        i = 0
+        for subscription_id, book in self.books.items():
+            handler = get_book_handler(
+                self.wsapi,
+                book,
+                subscription_id,
+                self.passthrough,
+                self.resync,
+                self.coalescer,
+            )
+            self.wsapi.set_handler(subscription_id, handler)
+        self.wsapi.on_resubscribe_dropped = self.count_resubscribe
+
+    async def __tick_stats(self):
         while True:
-            i += 1
-            try:
-                handle_ws_feed(self.wsapi, self.books)
-                time.sleep(0.01)
+            await asyncio.sleep(self.stats.interval)
+            self.stats.dump()
+
+    async def __check_resync(self):
+        while True:
+            await asyncio.sleep(1.0)
+            self.resync.check_timeouts()
+
+    async def __feed_async(self, duration: Optional[float] = None):
+        for wsapi in self.wsapis:
+            await wsapi.connect()
+        tasks = [asyncio.create_task(wsapi.dispatch()) for wsapi in self.wsapis]
+        ticker = asyncio.create_task(self.__tick_stats())
+        if self.resync is not None:
+            tasks.append(asyncio.create_task(self.__check_resync()))
+        try:
+            # until the primary closes (or the secondary fails)
+            done, _ = await asyncio.wait(
+                tasks, timeout=duration, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                task.result()
+        finally:
+            ticker.cancel()
+            for task in tasks:
+                task.cancel()
+            for wsapi in self.wsapis:
+                await wsapi.close()
+            if self.coalescer is not None:
+                self.coalescer.flush()
 
+    def feed(self, duration: Optional[float] = None):
+        """ duration: stop after this many seconds (None: run until interrupted) """
+        if self.use_asyncio:
+            try:
+                asyncio.run(self.__feed_async(duration))
             except KeyboardInterrupt:
                 print("KeyboardInterrupt")
-                break
-            except Exception as e:
-                del self.wsapi
-                raise e
+            finally:
+                self.stop_writer()
+            return
+
+        end = None if duration is None else time.time() + duration
+        try:
+            while end is None or time.time() < end:
+                for wsapi in self.wsapis:
+                    wsapi.dispatch()
+                if self.coalescer is not None:
+                    self.coalescer.flush()
+                if self.resync is not None:
+                    self.resync.check_timeouts()
+                self.stats.tick()
+                time.sleep(0.01)
+
+        except KeyboardInterrupt:
+            print("KeyboardInterrupt")
+        finally:
+            for wsapi in self.wsapis:
+                wsapi.close()
+            self.stop_writer()
+
+    def ingest_stats(self) -> dict[str, Any]:
+        """ ingest buffer of the primary connection, lag by pair """
+        buffer = getattr(self.wsapi.connection, "buffer", None)  # threaded only
+        return {
+            "buffer": buffer.stats() if buffer is not None else None,
+            "lag": {book.assetPair.name: book.lag for book in self.books.values()},
+        }
+
+    def count_resubscribe(self, subscription_id: int):
+        """ the primary resubscribed the book for updates it dropped """
+        book = self.books.get(subscription_id)
+        if book is not None and book.stats is not None:
+            book.stats.resubscribes += 1
+
+    def stop_writer(self):
+        """ writes all queued records and archives the open files """
+        if self.writerStage is not None:
+            self.writerStage.stop()
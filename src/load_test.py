@@ -0,0 +1,218 @@
+import copy
+import json
+import time
+import shutil
+import tempfile
+import multiprocessing
+from bisect import bisect_right
+from itertools import islice
+from typing import Any, Callable, Optional
+from .coalescer import BatchHandler, Coalescer
+from .live_feed import LiveFeed, get_book_handler
+from .replay_server import ReplayServer, repo_source, synthetic_source
+from .repo import RepoWriter
+from .utils import AssetPair
+
+
+"""
+Load test of the live capture (LiveFeed -> WSAPI -> SocketManager -> Book
+-> RepoWriter) against a local ReplayServer, at increasing speeds.
+
+Every step runs a fresh server process for stepSeconds and reports:
+
+sent / processed: messages per second sent by the server / handled by Books
+latency:          ms from sent to handled, percentiles
+queue:            messages sent but not handled yet (max, at the end)
+ingest:           stats of the ingest buffer at the end (threaded WSAPI)
+pairs:            stats of the books over the step, see stats
+overloaded:       the queue grew, or less than 95% of sent was handled
+
+and the summary: the highest rate handled without overload ("sustained")
+and the rate of the first overloaded step ("saturation").
+
+conf["loadTest"]:
+{"speeds": [1, 2, 5, 10, 20, 50, null], "stepSeconds": 5,
+ "maxUpdates": 20000, "outPath": "load_test.json"}
+
+speeds are multiples of the replayServer's timing (conf["replayServer"]),
+null is flat out. maxUpdates: per pair and step.
+"""
+
+
+def get_updates(
+    conf: dict[str, Any], assetPairs: list[AssetPair], max_updates: int
+) -> dict[str, list[tuple[float, str]]]:
+    """ encoded once, so that the server only has to send them """
+    server_conf = conf.get("replayServer", {})
+    depth = conf["repo"]["depth"]
+    rate = server_conf.get("rate", 100)
+    seed = server_conf.get("seed", 0)
+
+    from_repo = server_conf.get("source", "synthetic") == "repo"
+
+    updates = {}
+    for i, assetPair in enumerate(assetPairs):
+        if from_repo:
+            source = repo_source(conf, assetPairs)
+        else:  # a different book per pair
+            source = synthetic_source(depth, rate, seed + i, max_updates)
+        items = islice(source(assetPair.ws_name), max_updates + 1)
+        updates[assetPair.ws_name] = [
+            (t, json.dumps(data, separators=(",", ":"))) for t, data in items
+        ]
+    return updates
+
+
+def run_server(updates: dict, depth: int, speed, port: int, duration, ready, results):
+    """ process target, puts the send times (by pair) on results when done """
+    import asyncio
+
+    server = ReplayServer(lambda ws_name: updates[ws_name], depth, speed, port=port)
+    asyncio.run(server.serve(duration, ready))
+    results.put(server.sent_times)
+
+
+def percentiles(values: list[float]) -> dict[str, Optional[float]]:
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+
+    def at(q: float) -> float:
+        return values[min(int(len(values) * q), len(values) - 1)]
+
+    return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": values[-1]}
+
+
+class TimedCoalescer:
+    """ Coalescer of LiveFeed that notes when the updates of a batch were handled """
+
+    def __init__(self, coalescer: Coalescer, handled_times: list[float]):
+        self.coalescer = coalescer
+        self.handled_times = handled_times
+
+    def get_handler(
+        self, handle_batch: BatchHandler, keep_raw: bool = False
+    ) -> Callable[[list, str], None]:
+        def timed_batch(batch: list[tuple[list, Optional[str]]]):
+            handle_batch(batch)
+            self.handled_times.extend([time.time()] * len(batch))
+
+        return self.coalescer.get_handler(timed_batch, keep_raw)
+
+
+def run_step(
+    conf: dict[str, Any],
+    assetPairs: list[AssetPair],
+    updates: dict,
+    speed: Optional[float],
+    step_seconds: float,
+) -> dict[str, Any]:
+    server_conf = conf.get("replayServer", {})
+    port = server_conf.get("port", 8765)
+    context = multiprocessing.get_context("spawn")
+    ready, results = context.Event(), context.Queue()
+    depth = conf["repo"]["depth"]
+    server = context.Process(
+        target=run_server,
+        args=(updates, depth, speed, port, step_seconds + 1.0, ready, results),
+        daemon=True,
+    )
+    server.start()
+    ready.wait()
+
+    data_dir = tempfile.mkdtemp(prefix="load_test_")
+    client_conf = copy.deepcopy(conf)
+    client_conf["repo"]["dataDir"] = data_dir
+    client_conf.setdefault("wsapi", {})["apiDomain"] = f"ws://localhost:{port}"
+    # no dumps, collected once at the end
+    client_conf["stats"] = {"interval": 10 * step_seconds, "summary": False}
+    liveFeed = LiveFeed(client_conf, assetPairs, save_to_repo=True)
+
+    # handled times by pair, next to the book handlers of LiveFeed
+    handled: dict[str, list[float]] = {}
+    for subscription_id, book in liveFeed.books.items():
+        handled_times = handled.setdefault(book.assetPair.ws_name, [])
+        coalescer = None
+        if liveFeed.coalescer is not None:
+            coalescer = TimedCoalescer(liveFeed.coalescer, handled_times)
+        handle = get_book_handler(
+            liveFeed.wsapi,
+            book,
+            subscription_id,
+            liveFeed.passthrough,
+            liveFeed.resync,
+            coalescer,
+        )
+        if coalescer is not None:
+            liveFeed.wsapi.set_handler(subscription_id, handle)
+            continue
+
+        def timed(data, raw, handle=handle, handled_times=handled_times):
+            handle(data, raw)
+            handled_times.append(time.time())
+
+        liveFeed.wsapi.set_handler(subscription_id, timed)
+
+    liveFeed.feed(step_seconds)
+    ingest = liveFeed.ingest_stats()
+    stats = liveFeed.stats.collect()
+    sent_times = results.get()
+    server.join()
+
+    for book in liveFeed.books.values():
+        if isinstance(book.repoWriter, RepoWriter):
+            book.repoWriter.close_file()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    latencies, sent, handled_all = [], [], []
+    for ws_name, times in sent_times.items():
+        handled_times = handled.get(ws_name, [])
+        latencies += [(h - t) * 1e3 for t, h in zip(times, handled_times)]
+        sent += times
+        handled_all += handled_times
+    sent.sort()
+    handled_all.sort()
+
+    # queue (sent, not handled yet) over the step
+    start = sent[0] if sent else time.time()
+    grid = [start + step_seconds * (i + 1) / 20 for i in range(20)]
+    queue = [bisect_right(sent, t) - bisect_right(handled_all, t) for t in grid]
+    n_sent = bisect_right(sent, grid[-1])
+    n_handled = bisect_right(handled_all, grid[-1])
+    growing = min(queue[-5:]) > max(queue[:5]) + 10
+    return {
+        "speed": speed,
+        "sent": n_sent / step_seconds,
+        "processed": n_handled / step_seconds,
+        "latency_ms": percentiles(latencies),
+        "queue": {"max": max(queue), "end": queue[-1]},
+        "overloaded": growing or n_handled < 0.95 * n_sent,
+        "ingest": ingest["buffer"],
+        "pairs": stats["pairs"],
+    }
+
+
+def run_load_test(conf: dict[str, Any], assetPairs: list[AssetPair]) -> dict[str, Any]:
+    test_conf = conf.get("loadTest", {})
+    speeds = test_conf.get("speeds", [1, 2, 5, 10, 20, 50, None])
+    step_seconds = test_conf.get("stepSeconds", 5)
+    updates = get_updates(conf, assetPairs, test_conf.get("maxUpdates", 20000))
+
+    steps = []
+    for speed in speeds:
+        step = run_step(conf, assetPairs, updates, speed, step_seconds)
+        steps.append(step)
+        print(f"\nspeed {speed}: {step}")
+
+    handled = [step["processed"] for step in steps if not step["overloaded"]]
+    overloaded = [step for step in steps if step["overloaded"]]
+    report = {
+        "steps": steps,
+        "sustained": max(handled) if handled else None,
+        "saturation": overloaded[0]["sent"] if overloaded else None,
+    }
+    out_path = test_conf.get("outPath")
+    if out_path is not None:
+        with open(out_path, "w") as file:
+            json.dump(report, file, indent=2)
+    return report
@@ -0,0 +1,36 @@
+"""
+Passthrough records ("passthrough": true in conf["repo"]).
+
+A passthrough record keeps the websocket frame exactly as received, in
+place of the decoded "data":
+
+{"status": true, "id": 5, "tor": 1600000000.1, "raw": [336, {"a": ...}, ...]}
+
+The frame text is pasted into the line as is, so it is never encoded a
+second time. Readers turn it back into a regular record (decode_raw).
+"""
+
+
+def can_pass_through(raw) -> bool:
+    """ frames with line breaks would break the JSONL files """
+    return isinstance(raw, str) and "\n" not in raw
+
+
+def is_raw_snapshot(raw: str) -> bool:
+    return '"as":' in raw or '"bs":' in raw
+
+
+def encode_raw(record: dict) -> str:
+    status = "true" if record["status"] else "false"
+    head = f'{{"status": {status}, "id": {record["id"]}, "tor": {record["tor"]!r}'
+    return f'{head}, "raw": {record["raw"]}}}'
+
+
+def decode_raw(record: dict) -> dict:
+    """ replaces the (parsed) "raw" frame of a record by its "data" """
+    data = {}
+    for item in record.pop("raw")[1:]:
+        if isinstance(item, dict):  # asks and bids may come in separate dicts
+            data.update(item)
+    record["data"] = data
+    return record
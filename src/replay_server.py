@@ -0,0 +1,174 @@
+import json
+import time
+import asyncio
+import itertools
+from typing import Any, Callable, Iterable, Optional
+import websockets
+from .binary_format import to_plain
+from .repo import RepoReader
+from .synthetic import synthetic_updates
+from .utils import AssetPair
+
+
+"""
+Local stand-in for the kraken ws-api, to run LiveFeed without the exchange
+(conf["wsapi"]["apiDomain"] = "ws://localhost:8765").
+
+It answers "subscribe" / "unsubscribe" events with the subscriptionStatus
+messages WSAPI expects, and streams "book" updates of the subscribed pairs:
+recorded ones (RepoReader) or synthetic ones. Every subscription replays
+its source from the start, so it always begins with a snapshot.
+
+speed: 1.0 real time (times of recording), 10.0 ten times faster,
+None as fast as the client takes them.
+
+conf["replayServer"]:
+{"host": "localhost", "port": 8765, "source": "synthetic", "rate": 100,
+ "speed": 1.0, "seed": 0}
+
+rate: synthetic updates per second and pair, at speed 1.0
+"""
+
+# source(ws_name) -> [(time, book update), ...], updates may be JSON encoded
+Source = Callable[[str], Iterable[tuple[float, dict]]]
+
+
+def synthetic_source(depth: int, rate: float = 100.0, seed: int = 0, n=None):
+    def source(ws_name: str) -> Iterable[tuple[float, dict]]:
+        updates = synthetic_updates(depth, seed, n, interval=1 / rate)
+        return ((i / rate, data) for i, data in enumerate(updates))
+
+    return source
+
+
+def repo_source(conf: dict[str, Any], assetPairs: list[AssetPair]) -> Source:
+    depth = conf["repo"]["depth"]
+    data_dir = conf["repo"]["dataDir"]
+    names = {assetPair.ws_name: assetPair.name for assetPair in assetPairs}
+
+    def source(ws_name: str) -> Iterable[tuple[float, dict]]:
+        repoReader = RepoReader("KRAKEN", f"BOOK{depth}", names[ws_name], data_dir)
+        records = repoReader.data_generator()
+        return ((data["tor"], to_plain(data["data"])) for data in records)
+
+    return source
+
+
+class ReplayServer:
+    def __init__(
+        self,
+        source: Source,
+        depth: int,
+        speed: Optional[float] = 1.0,
+        host: str = "localhost",
+        port: int = 8765,
+    ):
+        self.source = source
+        self.depth = depth
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.sent_times: dict[str, list[float]] = {}  # by pair, see load_test
+
+        self.__channel_ids: dict[str, int] = {}
+        self.__next_channel_id = itertools.count(100)
+
+    def get_channel_id(self, ws_name: str) -> int:
+        """ the same pair keeps its channel, like on kraken """
+        if ws_name not in self.__channel_ids:
+            self.__channel_ids[ws_name] = next(self.__next_channel_id)
+        return self.__channel_ids[ws_name]
+
+    async def __stream(self, ws, channel_id: int, ws_name: str):
+        head = f"[{channel_id},"
+        tail = f',"book-{self.depth}","{ws_name}"]'
+        sent_times = self.sent_times.setdefault(ws_name, [])
+
+        start, t0 = time.time(), None
+        for i, (t, data) in enumerate(self.source(ws_name)):
+            if self.speed is not None:
+                t0 = t if t0 is None else t0
+                delay = start + (t - t0) / self.speed - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 64 == 0:
+                await asyncio.sleep(0)  # let the other streams in
+
+            if not isinstance(data, str):  # else encoded already
+                data = json.dumps(data, separators=(",", ":"))
+            try:
+                await ws.send(head + data + tail)
+            except websockets.ConnectionClosed:
+                return
+            sent_times.append(time.time())
+
+    async def __handle_event(self, ws, event: dict, streams: dict):
+        subscription = event.get("subscription", {})
+        for ws_name in event.get("pair", []):
+            channel_id = self.get_channel_id(ws_name)
+            stream = streams.pop(ws_name, None)
+            if stream is not None:
+                stream.cancel()
+
+            subscribe = event["event"] == "subscribe"
+            await ws.send(
+                json.dumps(
+                    {
+                        "channelID": channel_id,
+                        "channelName": f"book-{self.depth}",
+                        "event": "subscriptionStatus",
+                        "pair": ws_name,
+                        "reqid": event.get("reqid"),
+                        "status": "subscribed" if subscribe else "unsubscribed",
+                        "subscription": subscription,
+                    }
+                )
+            )
+            if subscribe:
+                streams[ws_name] = asyncio.create_task(
+                    self.__stream(ws, channel_id, ws_name)
+                )
+
+    async def handle_connection(self, ws):
+        streams: dict[str, asyncio.Task] = {}
+        await ws.send(json.dumps({"event": "systemStatus", "status": "online"}))
+        try:
+            async for msg in ws:
+                event = json.loads(msg)
+                if event.get("event") in ("subscribe", "unsubscribe"):
+                    await self.__handle_event(ws, event, streams)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for stream in streams.values():
+                stream.cancel()
+
+    async def serve(self, duration: Optional[float] = None, ready=None):
+        """ duration: seconds until the server closes (None: forever) """
+        async with websockets.serve(self.handle_connection, self.host, self.port):
+            print(f"replay server on ws://{self.host}:{self.port}")
+            if ready is not None:
+                ready.set()
+            if duration is None:
+                await asyncio.Future()  # forever
+            await asyncio.sleep(duration)
+
+    @classmethod
+    def from_conf(
+        cls, conf: dict[str, Any], assetPairs: list[AssetPair]
+    ) -> "ReplayServer":
+        server_conf = conf.get("replayServer", {})
+        depth = conf["repo"]["depth"]
+        if server_conf.get("source", "synthetic") == "repo":
+            source = repo_source(conf, assetPairs)
+        else:
+            rate = server_conf.get("rate", 100)
+            source = synthetic_source(depth, rate, server_conf.get("seed", 0))
+
+        return cls(
+            source,
+            depth,
+            speed=server_conf.get("speed", 1.0),
+            host=server_conf.get("host", "localhost"),
+            port=server_conf.get("port", 8765),
+        )
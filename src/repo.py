@@ -1,13 +1,101 @@
 import time
 import os
 import json
+import heapq
+import threading
+from bisect import bisect_right
 from io import TextIOWrapper
+from itertools import chain
+from queue import Queue
+from typing import Iterable, Iterator, Optional
 from .utils import zip_, rm
+from . import binary_format
+from .raw_frame import decode_raw, encode_raw, is_raw_snapshot
+from .segment import CODECS, SegmentFile, iter_chunks, strip_container_suffix
 
 
-def get_curr_hour_ts() -> int:
-    return int(time.time()) // (60) * 60
-    # return int(time.time()) // (60 * 60) * 60 * 60
+class RotationPolicy:
+    """
+    When RepoWriter starts a new file.
+
+    time policy: every "interval" seconds (aligned to the epoch).
+    size policy: once "max_bytes" (uncompressed) were written to the file,
+    at the next record that carries a snapshot. Book attaches one as soon
+    as needs_snapshot() turns True, so every file starts with one.
+
+    conf["repo"]["rotation"]: {"interval": 60, "maxBytes": null}
+    """
+
+    def __init__(self, interval: int = 60, max_bytes: Optional[int] = None):
+        self.interval = interval
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_conf(cls, conf: dict) -> "RotationPolicy":
+        return cls(conf.get("interval", 60), conf.get("maxBytes"))
+
+    def get_period(self) -> int:
+        return int(time.time()) // self.interval * self.interval
+
+
+class CheckpointPolicy:
+    """
+    When Book attaches a full snapshot (a checkpoint) to a record, besides
+    the one that starts each file: every "every_messages" records or every
+    "every_seconds" seconds since the last snapshot. See RepoReader.seek
+
+    conf["repo"]["checkpoint"]: {"everyMessages": null, "everySeconds": null}
+    """
+
+    def __init__(
+        self,
+        every_messages: Optional[int] = None,
+        every_seconds: Optional[float] = None,
+    ):
+        self.every_messages = every_messages
+        self.every_seconds = every_seconds
+
+    @classmethod
+    def from_conf(cls, conf: dict) -> "CheckpointPolicy":
+        return cls(conf.get("everyMessages"), conf.get("everySeconds"))
+
+    def is_due(self, n_messages: int, n_seconds: float) -> bool:
+        if self.every_messages is not None and n_messages >= self.every_messages:
+            return True
+        return self.every_seconds is not None and n_seconds >= self.every_seconds
+
+
+INDEX_SUFFIX = ".idx"
+
+
+def get_index_path(file_path: str) -> str:
+    """
+    sidecar index of a repo file: one "tor id offset" line per snapshot.
+    offset: byte offset of the record in the uncompressed file, or of the
+    compressed block it starts for segments.
+    """
+    return strip_container_suffix(file_path) + INDEX_SUFFIX
+
+
+def read_index(file_path: str) -> list[tuple[float, int, int]]:
+    index_path = get_index_path(file_path)
+    if not os.path.exists(index_path):
+        return []
+
+    with open(index_path) as file:
+        rows = [line.split() for line in file if line.endswith("\n")]
+    return [(float(tor), int(id_), int(offset)) for tor, id_, offset in rows]
+
+
+def is_snapshot(data: dict) -> bool:
+    if "raw" in data:
+        return is_raw_snapshot(data["raw"])
+    return "as" in data["data"] or "bs" in data["data"]
+
+
+def parse_line(line: str) -> dict:
+    data = json.loads(line)
+    return decode_raw(data) if "raw" in data else data
 
 
 class Repo:
@@ -23,77 +111,464 @@ class Repo:
     def get_file_name(self, curr_period: int):
         return self.get_base_name() + f"_{curr_period}"
 
+    def get_file_period(self, file_path: str) -> int:
+        """ inverse of get_file_name, ignoring segment number and suffixes """
+        file_name = os.path.basename(file_path)[len(self.get_base_name()) + 1 :]
+        return int(file_name.split("_")[0].split(".")[0])
+
 
 def get_file_paths(directory, pattern):
-    file_names = os.listdir(directory)
+    file_names = [fn for fn in os.listdir(directory) if not fn.endswith(INDEX_SUFFIX)]
     file_paths = [os.path.join(directory, fn) for fn in file_names if pattern in fn]
     return sorted(file_paths)
 
 
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """ complete lines of a stream of byte chunks """
+    rest = b""
+    for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+
+
+def is_binary(file_path: str) -> bool:
+    return strip_container_suffix(file_path).endswith(BinaryRepoWriter.suffix)
+
+
+def parse_chunks(
+    file_path: str, chunks: Iterable[bytes], precision: Optional[tuple] = None
+) -> Iterator[dict]:
+    """
+    records of file_path, decoded from its (decompressed) chunks.
+    binary files: pass the header's precision when chunks start after it.
+    """
+    if is_binary(file_path):
+        return binary_format.iter_records(chunks, precision)
+    return (parse_line(line) for line in iter_lines(chunks) if line)
+
+
+def read_file(file_path: str) -> Iterator[dict]:
+    """ records of a plain, .zip or segment file (JSONL or binary) """
+    if file_path.endswith(BinaryRepoWriter.suffix):
+        return binary_format.read_records(file_path)
+    return parse_chunks(file_path, iter_chunks(file_path))
+
+
+class Prefetcher(threading.Thread):
+    """
+    Reads and decompresses files ahead of the parser, in a background
+    thread. Chunks are passed on through a bounded queue, so the next file
+    is read while the current one is parsed, with bounded memory.
+    """
+
+    def __init__(
+        self, file_paths: list[str], max_chunks: int = 8, chunk_size: int = 1 << 20
+    ):
+        super(Prefetcher, self).__init__(daemon=True)
+        self.file_paths = file_paths
+        self.chunk_size = chunk_size
+        self.__queue = Queue(maxsize=max_chunks)
+
+    def run(self):
+        """ override threading.Thread's "run" method. """
+        try:
+            for file_path in self.file_paths:
+                for chunk in iter_chunks(file_path, self.chunk_size):
+                    self.__queue.put(chunk)
+                self.__queue.put(None)  # end of file
+        except Exception as e:
+            self.__queue.put(e)
+
+    def iter_file(self) -> Iterator[bytes]:
+        """ chunks of the next file """
+        while True:
+            chunk = self.__queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
 class RepoReader(Repo):
     def __init__(
-        self, exchange: str, stream_name: str, pair_name: str, data_dir: str
+        self,
+        exchange: str,
+        stream_name: str,
+        pair_name: str,
+        data_dir: str,
+        prefetch: bool = True,
+        max_chunks: int = 8,
+        chunk_size: int = 1 << 20,
     ) -> None:
         super(RepoReader, self).__init__(exchange, stream_name, pair_name, data_dir)
 
+        self.prefetch = prefetch
+        self.max_chunks = max_chunks  # read-ahead of the prefetcher
+        self.chunk_size = chunk_size
         self.file_paths = self.get_file_paths()
         print(self.file_paths)
 
+        self.n_records = 0
+        self.n_bytes = 0  # decompressed
+        self.__t_start: Optional[float] = None
+        self.__t_stop: Optional[float] = None
+
     def get_file_paths(self):
         pattern = self.get_base_name()
         print(f"pattern: {pattern}")
         return get_file_paths(self._directory, pattern)
 
+    def __count_bytes(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.n_bytes += len(chunk)
+            yield chunk
+
     def data_generator(self):
+        prefetcher = None
+        if self.prefetch:
+            prefetcher = Prefetcher(self.file_paths, self.max_chunks, self.chunk_size)
+            prefetcher.start()
+
+        self.__t_start, self.__t_stop = time.perf_counter(), None
         for file_path in self.file_paths:
-            with open(file_path) as file:
-                for line in file.readlines():
-                    yield json.loads(line)
+            if prefetcher is not None:
+                chunks = prefetcher.iter_file()
+            else:
+                chunks = iter_chunks(file_path, self.chunk_size)
+
+            for data in parse_chunks(file_path, self.__count_bytes(chunks)):
+                self.n_records += 1
+                yield data
+        self.__t_stop = time.perf_counter()
+
+    def __find_snapshot(self, ts: float) -> tuple[int, int]:
+        """ (file number, offset) of the last snapshot at or before ts """
+        for i in reversed(range(len(self.file_paths))):
+            file_path = self.file_paths[i]
+            if self.get_file_period(file_path) > ts:
+                continue
+
+            index = read_index(file_path)
+            j = bisect_right([tor for tor, _, _ in index], ts) - 1
+            if j >= 0:
+                return i, index[j][2]
+            if not index:
+                return i, 0  # no index, every file starts with a snapshot
+        return 0, 0
+
+    def __iter_from(self, i: int, records: Iterator[dict]) -> Iterator[dict]:
+        yield from records
+        for file_path in self.file_paths[i:]:
+            yield from read_file(file_path)
+
+    def seek(self, ts: float, book) -> Iterator[dict]:
+        """
+        restores book to its state at time of recording ts, starting from
+        the last snapshot before ts, and returns the records after ts.
+        """
+        i, offset = self.__find_snapshot(ts)
+        file_path = self.file_paths[i]
+
+        precision = None
+        if is_binary(file_path) and offset > 0:
+            precision = binary_format.read_header(file_path)
+        chunks = iter_chunks(file_path, offset=offset)
+        records = parse_chunks(file_path, chunks, precision)
+
+        for data in records:
+            if data["tor"] > ts:
+                return self.__iter_from(i + 1, chain([data], records))
+            book.parse_ws_data(data["data"])
+            book.update_id = data["id"]
+        return self.__iter_from(i + 1, iter(()))
+
+    def stats(self) -> dict:
+        """ replay throughput of data_generator so far """
+        elapsed = float("nan")
+        if self.__t_start is not None:
+            elapsed = (self.__t_stop or time.perf_counter()) - self.__t_start
+        return {
+            "n_records": self.n_records,
+            "n_bytes": self.n_bytes,
+            "records_per_s": self.n_records / elapsed,
+            "mb_per_s": self.n_bytes / elapsed / 1e6,
+        }
+
+
+class MergedRepoReader:
+    """
+    Replays the repos of several pairs in global time of recording ("tor")
+    order: a k-way merge over a heap that holds the next record of every
+    pair. Memory is bounded by the read-ahead of each RepoReader.
+    """
+
+    def __init__(self, repoReaders: dict[str, RepoReader]) -> None:
+        self.repoReaders = repoReaders
+
+    @staticmethod
+    def merge(generators: dict[str, Iterator[dict]]) -> Iterator[tuple[str, dict]]:
+        """ yields (pair name, record); ties keep the order of generators """
+        pair_names = list(generators)
+        iterators = list(generators.values())
+
+        heap = []
+        for i, records in enumerate(iterators):
+            data = next(records, None)
+            if data is not None:
+                heap.append((data["tor"], i, data))
+        heapq.heapify(heap)
+
+        while heap:
+            _, i, data = heap[0]
+            yield pair_names[i], data
+
+            data = next(iterators[i], None)
+            if data is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (data["tor"], i, data))
+
+    def data_generator(self) -> Iterator[tuple[str, dict]]:
+        readers = self.repoReaders.items()
+        return self.merge({name: reader.data_generator() for name, reader in readers})
+
+    def seek(self, ts: float, books: dict) -> Iterator[tuple[str, dict]]:
+        """ restores books (by pair name) to ts, see RepoReader.seek """
+        readers = self.repoReaders.items()
+        return self.merge({name: r.seek(ts, books[name]) for name, r in readers})
+
+    def stats(self) -> dict:
+        return {name: reader.stats() for name, reader in self.repoReaders.items()}
+
+
+def archive(file_path: str) -> None:
+    zip_(file_path)
+    rm(file_path)
 
 
 class RepoWriter(Repo):
+    """
+    Writes book updates as JSON lines, one file per period (see RotationPolicy).
+
+    compression=None: plain files, zipped after they are closed.
+    compression="gzip"|"lzma": segments compressed while writing, see segment.
+    """
+
+    suffix = ""
+
     def __init__(
-        self, exchange: str, stream_name: str, pair_name: str, data_dir: str
+        self,
+        exchange: str,
+        stream_name: str,
+        pair_name: str,
+        data_dir: str,
+        rotation: Optional[RotationPolicy] = None,
+        compression: Optional[str] = None,
+        block_size: int = 1 << 18,
+        checkpoint: Optional[CheckpointPolicy] = None,
     ) -> None:
         super(RepoWriter, self).__init__(exchange, stream_name, pair_name, data_dir)
 
-        self.current_period = get_curr_hour_ts()
+        self.rotation = rotation or RotationPolicy()
+        self.checkpoint = checkpoint or CheckpointPolicy()
+        self.compression = compression
+        self.block_size = block_size
+
+        self.current_period = self.rotation.get_period()
+        self.segment = 0  # files started within the period by the size policy
+        self.n_bytes = 0
+        self.size_exceeded = False
+        self.n_snapshots = 0
+        self.n_since_snapshot = 0
+        self.last_snapshot_tor = 0.0
+        self.checkpoint_due = False
         self.target_path = self.get_target_path()
+        self.executor = None  # archive closed files here, if set (see WriterStage)
+        self.buffering = -1
 
         self.file = self.open_file()
+        self.index_file = self.open_index()
 
     def is_current_period(self):
-        return get_curr_hour_ts() == self.current_period
+        return self.rotation.get_period() == self.current_period
+
+    @property
+    def snapshot_due(self) -> bool:
+        return self.size_exceeded or self.checkpoint_due
+
+    def needs_snapshot(self) -> bool:
+        """ True if the next record should carry a snapshot of the full book """
+        return not self.is_current_period() or self.snapshot_due
 
     def get_target_path(self) -> str:
         file_name = self.get_file_name(self.current_period)
+        if self.segment:
+            file_name += f"_{self.segment:04d}"
+        file_name += self.suffix
+        if self.compression is not None:
+            file_name += CODECS[self.compression][0]
         return os.path.join(self._directory, file_name)
 
+    def _open(self, mode: str):
+        if self.compression is not None:
+            return SegmentFile(self.target_path, self.compression, self.block_size)
+        return open(self.target_path, mode, buffering=self.buffering)
+
     def open_file(self) -> TextIOWrapper:
         print(f"opening file: {self.target_path}")
-        return open(self.target_path, "a")
+        if self.compression is None and os.path.exists(self.target_path):
+            self.n_bytes = os.path.getsize(self.target_path)
+        return self._open("a")
+
+    def open_index(self) -> TextIOWrapper:
+        return open(get_index_path(self.target_path), "a", buffering=1)
 
     def close_file(self) -> None:
+        if self.file.closed:
+            return
+
+        self.index_file.close()
         self.file.close()
-        zip_(self.target_path)
-        rm(self.target_path)
+        # segments are compressed already, plain files get zipped
+        if self.compression is None and self.executor is not None:
+            self.executor.submit(archive, self.target_path)
+        elif self.compression is None:
+            archive(self.target_path)
         print(f"closed file: {self.target_path}")
 
-    def handle_file_path(self):
-        current_period = get_curr_hour_ts()
+    def flush(self, fsync: bool = False) -> None:
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+            os.fsync(self.index_file.fileno())
+
+    def handle_file_path(
+        self, current_period: Optional[int] = None, snapshot: bool = False
+    ):
+        current_period = current_period or self.rotation.get_period()
         if current_period != self.current_period:
-            self.close_file()
+            segment = 0
+        elif self.size_exceeded and snapshot:
+            segment = self.segment + 1
+        else:
+            return
 
-            self.current_period = current_period
-            self.target_path = self.get_target_path()
-            self.file = self.open_file()
+        self.close_file()
 
-    def write_line(self, data: dict) -> None:
-        self.handle_file_path()
+        self.current_period = current_period
+        self.segment = segment
+        self.n_bytes = 0
+        self.size_exceeded = False
+        self.target_path = self.get_target_path()
+        self.file = self.open_file()
+        self.index_file = self.open_index()
+
+    def __tell(self) -> int:
+        if self.compression is None:
+            return self.n_bytes
+        self.file.flush()  # start a new block
+        return self.file.tell()
+
+    def __update_snapshot_state(self, data: dict, snapshot: bool) -> None:
+        if snapshot:
+            self.n_snapshots += 1
+            self.n_since_snapshot = 0
+            self.last_snapshot_tor = data["tor"]
+        else:
+            self.n_since_snapshot += 1
+
+        n_seconds = data["tor"] - self.last_snapshot_tor
+        self.checkpoint_due = self.checkpoint.is_due(self.n_since_snapshot, n_seconds)
 
+        max_bytes = self.rotation.max_bytes
+        if max_bytes is not None and self.n_bytes >= max_bytes:
+            self.size_exceeded = True
+
+    def encode_line(self, data: dict) -> str:
+        if "raw" in data:
+            return encode_raw(data) + "\n"
+        return json.dumps(data) + "\n"
+
+    def write_record(self, data: dict, period: Optional[int] = None) -> None:
+        """ writes a record that already carries its "tor" to its period's file """
+        snapshot = is_snapshot(data)
+        self.handle_file_path(period, snapshot)
+        if snapshot:
+            self.index_file.write(f"{data['tor']} {data['id']} {self.__tell()}\n")
+
+        line = self.encode_line(data)
+        self.file.write(line)
+        self.n_bytes += len(line)
+        self.__update_snapshot_state(data, snapshot)
+
+    def write_line(self, data: dict) -> None:
         data.update({"tor": time.time()})  # time of recording
-        data_str = json.dumps(data)
-        self.file.write(data_str + "\n")
+        self.write_record(data)
 
     def __del__(self):
         self.close_file()
+
+
+class BinaryRepoWriter(RepoWriter):
+    """ writes records in the binary format, see binary_format """
+
+    suffix = ".bin"
+
+    def open_file(self):
+        print(f"opening file: {self.target_path}")
+        self.precision = None
+        if os.path.exists(self.target_path) and os.path.getsize(self.target_path):
+            self.precision = binary_format.read_header(self.target_path)
+            if self.compression is None:
+                self.n_bytes = os.path.getsize(self.target_path)
+        return self._open("ab")
+
+    def encode_line(self, data: dict) -> bytes:
+        if self.precision is not None:
+            return binary_format.encode_record(data, self.precision)
+
+        self.precision = binary_format.learn_precision(data.get("data", {}))
+        header = binary_format.encode_header(self.precision)
+        return header + binary_format.encode_record(data, self.precision)
+
+
+class QueuedRepoWriter:
+    """
+    Front end of a RepoWriter that runs on a WriterStage.
+
+    The period of a record (and with it the decision to attach a snapshot,
+    see Book.parse_ws_data) is taken on the calling thread. Encoding,
+    writing and rotating happen on the stage.
+    """
+
+    def __init__(self, repoWriter: RepoWriter, stage) -> None:
+        self.repoWriter = repoWriter
+        self.stage = stage
+        self.current_period = repoWriter.current_period
+        self.__requested_at = -1  # n_snapshots when a due snapshot was queued
+        stage.register(repoWriter)
+
+    def __is_snapshot_due(self) -> bool:
+        """ snapshot_due, unless the snapshot for it is still queued """
+        repoWriter = self.repoWriter
+        queued = repoWriter.n_snapshots == self.__requested_at
+        return repoWriter.snapshot_due and not queued
+
+    def is_current_period(self):
+        return self.repoWriter.rotation.get_period() == self.current_period
+
+    def needs_snapshot(self) -> bool:
+        return not self.is_current_period() or self.__is_snapshot_due()
+
+    def write_line(self, data: dict) -> None:
+        if self.__is_snapshot_due() and is_snapshot(data):
+            self.__requested_at = self.repoWriter.n_snapshots
+
+        self.current_period = self.repoWriter.rotation.get_period()
+        data.update({"tor": time.time()})  # time of recording
+        self.stage.put(self.repoWriter, self.current_period, data)
+
+
+REPO_WRITERS = {"jsonl": RepoWriter, "binary": BinaryRepoWriter}
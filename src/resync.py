@@ -0,0 +1,170 @@
+import time
+from typing import Any, Callable, Optional
+from .book import Book, compute_checksum
+from .wsapi import WSAPI
+from .wsapi.decoders import get_book_data
+
+
+"""
+Hitless resync of books that went out of sync.
+
+resubscribe_public unsubscribes and subscribes again on the same connection,
+so the pair has no valid book until the new snapshot arrives. Instead, the
+pair is subscribed on a secondary connection while the primary keeps
+streaming:
+
+1. the updates of the primary are buffered (not applied, not recorded)
+2. the snapshot (and updates) of the secondary are collected
+3. once a state of both streams has the same checksum, the snapshot is
+   rolled forward to it with the secondary updates and then with the
+   buffered primary updates after it, verifying every checksum
+4. the result is swapped into the book, and recorded as one snapshot
+   marked with "resync" (see Book.take_over)
+
+If that does not work out within maxBuffer primary updates or timeout
+seconds, the book falls back to resubscribe_public. The timeout is checked
+on every primary update and by check_timeouts (called by LiveFeed), as a
+pair might not get any updates at all.
+
+Off by default, as it costs a second websocket connection (and its
+subscriptions count against the rate limits): set "secondary": true to
+enable it. Without it, out of sync books are resubscribed on the primary
+connection.
+
+conf["wsapi"]["resync"]: {"secondary": true, "maxBuffer": 2000, "timeout": 30}
+"""
+
+
+class PendingResync:
+    """ state of one book while it resyncs """
+
+    def __init__(self, book: Book, public_id: int, fallback: Callable[[], None]):
+        self.book = book
+        self.public_id = public_id  # of the secondary subscription
+        self.fallback = fallback
+        self.started = time.time()
+        self.primary: list[dict] = []  # buffered updates, first one out of sync
+        self.secondary: list[dict] = []  # snapshot, updates
+        self.snapshot_checksum: Optional[int] = None
+
+
+def get_checksums(updates: list[dict], offset: int = 0) -> dict[int, int]:
+    """ checksum -> index (+ offset) of the last update that carries it """
+    checksums = {}
+    for i, data in enumerate(updates):
+        if data.get("c") is not None:
+            checksums[int(data["c"])] = i + offset
+    return checksums
+
+
+class Resync:
+    def __init__(
+        self, wsapi: WSAPI, depth: int, max_buffer: int = 2000, timeout: float = 30.0
+    ):
+        self.wsapi = wsapi  # the secondary connection
+        self.depth = depth
+        self.max_buffer = max_buffer
+        self.timeout = timeout
+        self.n_resyncs = 0
+        self.n_fallbacks = 0
+        self.__pending: dict[str, PendingResync] = {}  # by pair name
+
+    @classmethod
+    def from_conf(cls, wsapi: WSAPI, depth: int, conf: dict[str, Any]) -> "Resync":
+        return cls(
+            wsapi,
+            depth,
+            max_buffer=conf.get("maxBuffer", 2000),
+            timeout=conf.get("timeout", 30.0),
+        )
+
+    def counts(self) -> dict[str, int]:
+        return {"resyncs": self.n_resyncs, "fallbacks": self.n_fallbacks}
+
+    def is_resyncing(self, book: Book) -> bool:
+        return book.assetPair.name in self.__pending
+
+    def start(self, book: Book, data: dict, fallback: Callable[[], None]) -> None:
+        """
+        data: the update that put book out of sync. fallback: resubscribes
+        on the primary connection
+        """
+        subscription_msg = {"name": "book", "depth": self.depth}
+        ws_name = book.assetPair.ws_name
+        public_id = self.wsapi.subscribe_public(subscription_msg, pair=[ws_name])
+        self.wsapi.set_handler(
+            public_id, lambda frame, raw: self.__on_secondary(book, frame)
+        )
+
+        pending = PendingResync(book, public_id, fallback)
+        pending.primary.append(data)
+        self.__pending[book.assetPair.name] = pending
+
+    def on_update(self, book: Book, data: dict) -> None:
+        """ update of the primary connection, while book resyncs """
+        pending = self.__pending[book.assetPair.name]
+        pending.primary.append(data)
+
+        too_long = time.time() - pending.started > self.timeout
+        if len(pending.primary) > self.max_buffer or too_long:
+            self.__fall_back(book)
+            return
+        self.__try_swap(book)
+
+    def check_timeouts(self) -> None:
+        """ falls back for the books that resync for longer than timeout """
+        now = time.time()
+        for pending in list(self.__pending.values()):
+            if now - pending.started > self.timeout:
+                self.__fall_back(pending.book)
+
+    def __on_secondary(self, book: Book, frame: list) -> None:
+        pending = self.__pending.get(book.assetPair.name)
+        if pending is None:
+            return  # updates sent before the unsubscribe was handled
+
+        data = get_book_data(frame)
+        if "as" in data or "bs" in data:
+            snapshot = Book(book.assetPair, book.depth, None, book.fixed_point)
+            snapshot.parse_ws_data(data)
+            pending.snapshot_checksum = compute_checksum(snapshot.asks, snapshot.bids)
+            pending.secondary = [data]
+        elif pending.secondary:
+            pending.secondary.append(data)
+        else:
+            return  # before the snapshot
+        self.__try_swap(book)
+
+    def __fall_back(self, book: Book) -> None:
+        pending = self.__stop(book)
+        self.n_fallbacks += 1
+        pending.fallback()
+
+    def __stop(self, book: Book) -> PendingResync:
+        pending = self.__pending.pop(book.assetPair.name)
+        self.wsapi.unsubscribe_public(pending.public_id)
+        return pending
+
+    def __try_swap(self, book: Book) -> None:
+        pending = self.__pending[book.assetPair.name]
+        if pending.snapshot_checksum is None:
+            return  # no snapshot yet
+
+        # the latest state both streams went through
+        secondary = get_checksums(pending.secondary[1:], offset=1)
+        secondary.setdefault(pending.snapshot_checksum, 0)
+        primary = get_checksums(pending.primary)
+        matches = [(i, secondary[c]) for c, i in primary.items() if c in secondary]
+        if not matches:
+            return
+        i, j = max(matches)
+
+        candidate = Book(book.assetPair, book.depth, None, book.fixed_point)
+        for data in pending.secondary[: j + 1] + pending.primary[i + 1 :]:
+            candidate.parse_ws_data(data)
+            if not candidate.insync:
+                return  # checksum collision, or a gap: wait for the next match
+
+        self.__stop(book)
+        self.n_resyncs += 1
+        book.take_over(candidate, len(pending.primary) - 1)
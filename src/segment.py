@@ -0,0 +1,146 @@
+import gzip
+import lzma
+import zlib
+import zipfile
+from typing import Iterator, Union
+
+
+"""
+Compressed segment files.
+
+A segment is a sequence of independently decodable compressed blocks: one
+gzip member or one xz stream per block. Concatenated members/streams are
+a valid .gz/.xz file, so gzip.open and lzma.open read a whole segment,
+and a segment that is still being written can be read up to its last
+complete block.
+"""
+
+CODECS = {
+    "gzip": (".gz", gzip.compress),
+    "lzma": (".xz", lzma.compress),
+}
+SUFFIXES = {suffix: codec for codec, (suffix, _) in CODECS.items()}
+ZIP_SUFFIX = ".zip"  # plain files archived by RepoWriter.close_file
+
+
+def get_codec(file_path: str):
+    """ returns the codec name of a segment path, None for plain files """
+    for suffix, codec in SUFFIXES.items():
+        if file_path.endswith(suffix):
+            return codec
+    return None
+
+
+def strip_container_suffix(file_path: str) -> str:
+    """ strips the codec or ".zip" suffix """
+    codec = get_codec(file_path)
+    if codec is not None:
+        return file_path[: -len(CODECS[codec][0])]
+    if file_path.endswith(ZIP_SUFFIX):
+        return file_path[: -len(ZIP_SUFFIX)]
+    return file_path
+
+
+def _new_decompressor(codec: str):
+    if codec == "gzip":
+        return zlib.decompressobj(wbits=31)
+    return lzma.LZMADecompressor()
+
+
+def iter_blocks(
+    file_path: str, chunk_size: int = 1 << 20, offset: int = 0
+) -> Iterator[bytes]:
+    """
+    yields the decompressed content of a segment block by block. An
+    incomplete last block (segment is still being written) is left out.
+    Plain files are yielded in chunks. offset: where a block starts (see
+    SegmentFile.tell), or any byte offset of a plain file.
+    """
+    codec = get_codec(file_path)
+    with open(file_path, "rb") as raw:
+        raw.seek(offset)
+        if codec is None:
+            yield from iter(lambda: raw.read(chunk_size), b"")
+            return
+
+        decompressor = _new_decompressor(codec)
+        block = []
+        for chunk in iter(lambda: raw.read(chunk_size), b""):
+            while chunk:
+                block.append(decompressor.decompress(chunk))
+                chunk = b""
+                if decompressor.eof:
+                    yield b"".join(block)
+                    block = []
+                    chunk = decompressor.unused_data
+                    decompressor = _new_decompressor(codec)
+
+
+def iter_chunks(
+    file_path: str, chunk_size: int = 1 << 20, offset: int = 0
+) -> Iterator[bytes]:
+    """
+    yields the decompressed content of a plain file, a segment or a .zip
+    archive in chunks, without holding the whole file in memory. An
+    archive has to be decompressed up to offset, the others seek to it.
+    """
+    if not file_path.endswith(ZIP_SUFFIX):
+        yield from iter_blocks(file_path, chunk_size, offset)
+        return
+
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open(archive.namelist()[0]) as file:
+            file.seek(offset)  # decompresses up to offset
+            yield from iter(lambda: file.read(chunk_size), b"")
+
+
+class SegmentFile:
+    """
+    write only file object that compresses its content into blocks of
+    about block_size (uncompressed) bytes. flush() ends the current block.
+    """
+
+    def __init__(
+        self, file_path: str, codec: str = "gzip", block_size: int = 1 << 18
+    ):
+        self.file_path = file_path
+        self.codec = codec
+        self.block_size = block_size
+        self.__compress = CODECS[codec][1]
+        self.__raw = open(file_path, "ab")
+        self.__pending = []
+        self.__n_pending = 0
+
+    @property
+    def closed(self) -> bool:
+        return self.__raw.closed
+
+    def fileno(self) -> int:
+        return self.__raw.fileno()
+
+    def tell(self) -> int:
+        """ offset where the next block starts, once pending data is flushed """
+        return self.__raw.tell()
+
+    def write(self, data: Union[str, bytes]) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.__pending.append(data)
+        self.__n_pending += len(data)
+        if self.__n_pending >= self.block_size:
+            self.__write_block()
+
+    def __write_block(self) -> None:
+        if self.__pending:
+            self.__raw.write(self.__compress(b"".join(self.__pending)))
+            self.__pending = []
+            self.__n_pending = 0
+
+    def flush(self) -> None:
+        self.__write_block()
+        self.__raw.flush()
+
+    def close(self) -> None:
+        if not self.closed:
+            self.flush()
+            self.__raw.close()
@@ -0,0 +1,151 @@
+import os
+import time
+import signal
+import multiprocessing
+from typing import Any, Optional
+from .utils import AssetPair
+
+
+"""
+Sharded live capture.
+
+The pairs are split over N shards. Every shard is a process with its own
+LiveFeed: one websocket connection, and the Books and RepoWriters of its
+pairs (no two shards write the same files, conf["stats"]["path"] gets
+the shard index, see shard_conf). The supervisor restarts shards that
+exit, after restartDelay seconds.
+
+conf["sharding"]: {"shards": 4, "restartDelay": 5.0, "maxRestarts": null}
+
+shards: 1 runs the LiveFeed in the main process, as before.
+maxRestarts: per shard, null for no limit.
+"""
+
+
+def split_pairs(assetPairs: list[AssetPair], n_shards: int) -> list[list[AssetPair]]:
+    """ round robin, so that pairs with similar names (and load) are spread """
+    n_shards = max(1, min(n_shards, len(assetPairs)))
+    return [assetPairs[i::n_shards] for i in range(n_shards)]
+
+
+def shard_conf(conf: dict[str, Any], i: int) -> dict[str, Any]:
+    """ conf of shard i: its own stats file, stats.jsonl -> stats_<i>.jsonl """
+    path = conf.get("stats", {}).get("path")
+    if path is None:
+        return conf
+    root, ext = os.path.splitext(path)
+    return {**conf, "stats": {**conf["stats"], "path": f"{root}_{i}{ext}"}}
+
+
+def run_shard(conf: dict[str, Any], assetPairs: list[AssetPair], save_to_repo: bool):
+    """ process target """
+    from .live_feed import LiveFeed
+
+    liveFeed = LiveFeed(conf, assetPairs, save_to_repo=save_to_repo)
+    liveFeed.feed()
+
+
+class ShardSupervisor:
+    def __init__(
+        self,
+        conf: dict[str, Any],
+        assetPairs: list[AssetPair],
+        n_shards: int,
+        restart_delay: float = 5.0,
+        max_restarts: Optional[int] = None,
+        save_to_repo: bool = True,
+    ):
+        self.conf = conf
+        self.save_to_repo = save_to_repo
+        self.restart_delay = restart_delay
+        self.max_restarts = max_restarts
+        self.shards = split_pairs(assetPairs, n_shards)
+
+        n = len(self.shards)
+        self.processes: list[Optional[multiprocessing.Process]] = [None] * n
+        self.n_restarts = [0] * n
+        self.__restart_at: list[Optional[float]] = [None] * n
+        # fresh interpreters: no threads or sockets inherited from the parent
+        self.__context = multiprocessing.get_context("spawn")
+
+    @classmethod
+    def from_conf(
+        cls, conf: dict[str, Any], assetPairs: list[AssetPair], save_to_repo=True
+    ) -> "ShardSupervisor":
+        sharding_conf = conf.get("sharding", {})
+        return cls(
+            conf,
+            assetPairs,
+            sharding_conf.get("shards", 1),
+            restart_delay=sharding_conf.get("restartDelay", 5.0),
+            max_restarts=sharding_conf.get("maxRestarts"),
+            save_to_repo=save_to_repo,
+        )
+
+    def start_shard(self, i: int) -> None:
+        process = self.__context.Process(
+            target=run_shard,
+            args=(shard_conf(self.conf, i), self.shards[i], self.save_to_repo),
+            name=f"shard-{i}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[i] = process
+        self.__restart_at[i] = None
+        pair_names = ", ".join(assetPair.name for assetPair in self.shards[i])
+        print(f"started shard {i} (pid {process.pid}): {pair_names}")
+
+    def start(self) -> None:
+        for i in range(len(self.shards)):
+            self.start_shard(i)
+
+    def poll(self) -> None:
+        """ schedules the restart of exited shards, restarts the due ones """
+        now = time.time()
+        for i, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+
+            if self.__restart_at[i] is None:
+                print(f"shard {i} exited with code {process.exitcode}")
+                if self.max_restarts is not None:
+                    if self.n_restarts[i] >= self.max_restarts:
+                        err = f"shard {i} exited {self.n_restarts[i] + 1} times"
+                        raise RuntimeError(err)
+                self.__restart_at[i] = now + self.restart_delay
+
+            elif now >= self.__restart_at[i]:
+                self.n_restarts[i] += 1
+                self.start_shard(i)
+
+    def stop(self, timeout: float = 10.0, interrupt: bool = True) -> None:
+        """
+        lets every shard close its files (KeyboardInterrupt, see LiveFeed.feed),
+        and terminates the ones that did not exit after timeout seconds.
+        interrupt=False if they were interrupted already (ctrl-c).
+        """
+        alive = [p for p in self.processes if p is not None and p.is_alive()]
+        if interrupt:
+            for process in alive:
+                os.kill(process.pid, signal.SIGINT)
+
+        deadline = time.time() + timeout
+        for process in alive:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def run(self, poll_interval: float = 1.0) -> None:
+        self.start()
+        try:
+            while True:
+                time.sleep(poll_interval)
+                self.poll()
+        except KeyboardInterrupt:
+            print("KeyboardInterrupt")
+            # the terminal sent SIGINT to the whole process group
+            self.stop(interrupt=False)
+        except Exception:
+            self.stop()
+            raise
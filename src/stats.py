@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import socket
+from bisect import bisect_left
+from typing import Any, Callable, Optional
+from termcolor import colored
+from .book import Book
+
+
+"""
+Live stats of the recorder, by pair:
+
+messages:     updates received (and msgs_per_s over the interval)
+out_of_sync:  Book.n_times_out_of_sync
+resubscribes: books resubscribed on the primary connection
+resyncs:      books resynced on a secondary connection, see resync
+lag:          seconds from the exchange timestamp of the last update applied
+decode, apply, checksum, write: latency histograms (µs) of decoding the
+              frame (WSAPI), applying it to the book, the checksum and
+              RepoWriter.write_line
+
+Every interval seconds, one JSON line of all of them (histograms of that
+interval only) is appended to path and/or sent to address (UDP,
+"host:port"), and a one-line summary is printed. Sharded, every shard
+appends to its own file (see shard.shard_conf).
+
+conf["stats"]:
+{"interval": 10, "path": "stats.jsonl", "address": null, "summary": true}
+"""
+
+# upper bounds of the histogram buckets in seconds, 10 per decade from 0.5µs
+# to 1s (and one above)
+BUCKETS = [10 ** (i / 10) for i in range(-63, 1)]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float, n: int = 1) -> None:
+        """ n: observations that took seconds each (e.g. updates of a batch) """
+        self.counts[bisect_left(BUCKETS, seconds)] += n
+        self.n += n
+        self.total += seconds * n
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """ upper bound of the bucket that holds the q-quantile """
+        if not self.n:
+            return None
+        rank, seen = q * self.n, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        """ in µs """
+
+        def us(seconds: Optional[float]) -> Optional[float]:
+            return None if seconds is None else round(seconds * 1e6, 2)
+
+        return {
+            "n": self.n,
+            "mean": us(self.total / self.n) if self.n else None,
+            "p50": us(self.percentile(0.5)),
+            "p90": us(self.percentile(0.9)),
+            "p99": us(self.percentile(0.99)),
+            "max": us(self.max) if self.n else None,
+        }
+
+
+class PairStats:
+    """ counters of one book (Book.stats), its histograms are reset per dump """
+
+    def __init__(self):
+        self.messages = 0
+        self.resubscribes = 0
+        self.resyncs = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.decode = LatencyHistogram()
+        self.apply = LatencyHistogram()
+        self.checksum = LatencyHistogram()
+        self.write = LatencyHistogram()
+
+
+class LiveStats:
+    def __init__(
+        self,
+        interval: float = 10.0,
+        path: Optional[str] = None,
+        address: Optional[str] = None,
+        summary: bool = True,
+    ):
+        self.interval = interval
+        self.path = path
+        self.summary = summary
+        self.books: list[Book] = []
+        self.sources: dict[str, Callable[[], Any]] = {}  # more to dump, by key
+
+        self.__address = None
+        self.__socket = None
+        if address is not None:
+            host, port = address.rsplit(":", 1)
+            self.__address = (host, int(port))
+            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.__last_dump = time.time()
+        self.__last_messages: dict[str, int] = {}
+
+    @classmethod
+    def from_conf(cls, conf: dict[str, Any]) -> "LiveStats":
+        return cls(
+            interval=conf.get("interval", 10.0),
+            path=conf.get("path"),
+            address=conf.get("address"),
+            summary=conf.get("summary", True),
+        )
+
+    def add_book(self, book: Book) -> None:
+        book.stats = PairStats()
+        self.books.append(book)
+
+    def tick(self) -> None:
+        """ dumps, if interval seconds passed since the last dump """
+        if time.time() - self.__last_dump >= self.interval:
+            self.dump()
+
+    def collect(self) -> dict[str, Any]:
+        now = time.time()
+        elapsed = max(now - self.__last_dump, 1e-9)
+        pairs = {}
+        for book in self.books:
+            name, stats = book.assetPair.name, book.stats
+            new_messages = stats.messages - self.__last_messages.get(name, 0)
+            self.__last_messages[name] = stats.messages
+            pairs[name] = {
+                "messages": stats.messages,
+                "msgs_per_s": new_messages / elapsed,
+                "out_of_sync": book.n_times_out_of_sync,
+                "resubscribes": stats.resubscribes,
+                "resyncs": stats.resyncs,
+                "lag": book.lag,
+                "decode_us": stats.decode.to_dict(),
+                "apply_us": stats.apply.to_dict(),
+                "checksum_us": stats.checksum.to_dict(),
+                "write_us": stats.write.to_dict(),
+            }
+            stats.reset()
+
+        record = {"time": now, "interval": elapsed, "pid": os.getpid()}
+        record["pairs"] = pairs
+        for key, source in self.sources.items():
+            record[key] = source()
+        self.__last_dump = now
+        return record
+
+    def dump(self) -> dict[str, Any]:
+        record = self.collect()
+        line = json.dumps(record)
+        if self.path is not None:
+            with open(self.path, "a") as file:
+                file.write(line + "\n")
+        if self.__socket is not None:
+            self.__socket.sendto(line.encode("utf-8"), self.__address)
+        if self.summary:
+            print_summary(record)
+        return record
+
+
+def print_summary(record: dict[str, Any]) -> None:
+    parts = []
+    for name, pair in record["pairs"].items():
+        part = f"{name} {pair['msgs_per_s']:.0f}/s"
+        apply_p50 = pair["apply_us"]["p50"]
+        if apply_p50 is not None:
+            part += f" apply {apply_p50:g}us"
+        problems = pair["out_of_sync"] + pair["resubscribes"] + pair["resyncs"]
+        if problems:
+            counts = (pair["out_of_sync"], pair["resubscribes"], pair["resyncs"])
+            part += colored(" oos/re/rs %d/%d/%d" % counts, "red")
+        parts.append(part)
+    print(time.strftime("%H:%M:%S"), " | ".join(parts), flush=True)
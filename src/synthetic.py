@@ -0,0 +1,62 @@
+import random
+from typing import Iterator, Optional
+from .book import Book, compute_checksum
+from .utils import AssetPair
+
+
+"""
+Synthetic "book" updates, shaped like the ones of the kraken ws-api:
+a snapshot ({"as", "bs"}) followed by updates ({"a", "b", "c"}) with
+valid checksums. Seeded, so every run sees the same updates.
+"""
+
+
+def synthetic_updates(
+    depth: int = 100,
+    seed: int = 0,
+    n: Optional[int] = None,
+    mid: float = 30000.0,
+    price_decimals: int = 1,
+    volume_decimals: int = 8,
+    t0: float = 1600000000.0,
+    interval: float = 0.01,
+) -> Iterator[dict]:
+    """ n updates after the snapshot (None: endless), one every interval seconds """
+    rnd = random.Random(seed)
+    book = Book(AssetPair("SYNTHETIC", {}), depth)
+    scale = 10 ** price_decimals
+    mid_ticks = round(mid * scale)
+
+    def level(ticks: int, t: float, empty: bool = False) -> list[str]:
+        volume = 0.0 if empty else rnd.uniform(0.001, 5.0)
+        price = f"{ticks / scale:.{price_decimals}f}"
+        return [price, f"{volume:.{volume_decimals}f}", f"{t:.6f}"]
+
+    asks = [level(mid_ticks + i, t0) for i in range(1, depth + 1)]
+    bids = [level(mid_ticks - i, t0) for i in range(1, depth + 1)]
+    snapshot = {"as": asks, "bs": bids}
+    book.parse_ws_data(snapshot)
+    yield snapshot
+
+    i = 0
+    while n is None or i < n:
+        i += 1
+        t = t0 + i * interval
+        data = {}
+        for key, side, sign in (("a", book.asks, 1), ("b", book.bids, -1)):
+            if rnd.random() < 0.4:
+                continue
+            rows = []
+            for _ in range(rnd.randint(1, 3)):
+                # mostly close to the spread, sometimes outside of the depth
+                ticks = mid_ticks + sign * int(rnd.expovariate(1 / (depth / 2)) + 1)
+                price = f"{ticks / scale:.{price_decimals}f}"
+                delete = rnd.random() < 0.5 * len(side) / depth  # keeps it filled
+                rows.append(level(ticks, t, delete and price in side))
+            data[key] = rows
+        if not data:
+            data["a"] = [level(mid_ticks + 1, t)]
+
+        book.parse_ws_data(data)
+        data["c"] = str(compute_checksum(book.asks, book.bids))
+        yield data
@@ -1,5 +1,7 @@
 import sys, os, json
+import time
 import zipfile
+from typing import Any, Optional
 
 # from crypto_apis.kraken import API
 from .wsapi.api import API
@@ -32,11 +34,45 @@ def unzip_(file2unzip: str, target_dir: str = "."):
         zip_ref.extractall(target_dir)
 
 
-def query_asset_pairs():
-    api = API()
+def get_decimals(value: str) -> int:
+    return len(value.partition(".")[2])
+
+
+def to_fixed(value: str, decimals: int) -> Optional[int]:
+    """ returns None if value does not have exactly "decimals" decimals """
+    whole, _, frac = value.partition(".")
+    if len(frac) != decimals:
+        return None
+    return int(whole + frac)
+
+
+def from_fixed(value: int, decimals: int) -> str:
+    if decimals == 0:
+        return str(value)
+    digits = str(value).rjust(decimals + 1, "0")
+    return digits[:-decimals] + "." + digits[-decimals:]
+
+
+def query_asset_pairs(api: Optional[API] = None):
+    api = api or API()
     return api.query_public("AssetPairs")["result"]
 
 
+def read_asset_pairs_cache(cache_path: str) -> Optional[tuple[float, dict]]:
+    """ (time of the query, asset pairs), None if there is no cache """
+    if not os.path.exists(cache_path):
+        return None
+    cache = read_json(cache_path)
+    return cache["time"], cache["result"]
+
+
+def write_asset_pairs_cache(cache_path: str, asset_pairs: dict) -> None:
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"time": time.time(), "result": asset_pairs}, file)
+    os.replace(tmp_path, cache_path)  # never a half written cache
+
+
 class AssetPair:
     def __init__(self, name: str, info: dict):
         self.name = name
@@ -58,15 +94,68 @@ class AssetPair:
 
 
 class AssetInfo:
-    def __init__(self):
-        self.asset_pairs = query_asset_pairs()
+    """
+    Kraken's "AssetPairs", cached in cache_path for ttl seconds.
+
+    offline: only the cache is read, however old it is (replay, analytics).
+    If the query fails, an outdated cache is used as well.
+
+    conf["assetInfo"]:
+    {"cachePath": "asset_pairs.json", "ttl": 86400, "offline": false}
+    """
+
+    def __init__(
+        self,
+        cache_path: Optional[str] = None,
+        ttl: float = 86400,
+        offline: bool = False,
+        api: Optional[API] = None,
+    ):
+        self.asset_pairs = self.__load(cache_path, ttl, offline, api)
+
+        # name, altname and wsname -> name, the first pair wins
+        self.__index: dict[str, str] = {}
+        for k, v in self.asset_pairs.items():
+            for key in (k, v.get("altname"), v.get("wsname")):
+                if key is not None:
+                    self.__index.setdefault(key, k)
+
+    @classmethod
+    def from_conf(cls, conf: dict[str, Any], offline: bool = False) -> "AssetInfo":
+        return cls(
+            cache_path=conf.get("cachePath"),
+            ttl=conf.get("ttl", 86400),
+            offline=offline or conf.get("offline", False),
+        )
+
+    @staticmethod
+    def __load(
+        cache_path: Optional[str], ttl: float, offline: bool, api: Optional[API]
+    ) -> dict:
+        cache = read_asset_pairs_cache(cache_path) if cache_path else None
+        if offline and cache is None:
+            raise ValueError(f"offline, but no asset pairs cached in {cache_path}")
+        if cache is not None and (offline or time.time() - cache[0] < ttl):
+            return cache[1]
+
+        try:
+            asset_pairs = query_asset_pairs(api)
+        except Exception as e:
+            if cache is None:
+                raise e
+            print(f"using outdated asset pairs of {cache_path}: {e!r}")
+            return cache[1]
+
+        if cache_path:
+            write_asset_pairs_cache(cache_path, asset_pairs)
+        return asset_pairs
 
     def get_asset_info(self, pair_name: str):
         """ Returns tuple of (name, info) """
-        for k, v in self.asset_pairs.items():
-            if pair_name.upper() in [k, v.get("altname"), v.get("wsname")]:
-                return k, v
-        raise ValueError(f"pair not found: {pair_name}")
+        name = self.__index.get(pair_name.upper())
+        if name is None:
+            raise ValueError(f"pair not found: {pair_name}")
+        return name, self.asset_pairs[name]
 
     def get_asset_pair(self, pair_name: str):
         """ Returns an AssetPair object """
@@ -0,0 +1,162 @@
+import time
+import threading
+from queue import Queue, Empty, Full
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from .repo import RepoWriter
+
+
+class WriterStage(threading.Thread):
+    """
+    WriterStage takes file writes and hourly archiving off the websocket loop.
+
+    Books put their records on a bounded queue (put blocks when it is full).
+    The stage writes them in groups of up to batch_size into large file
+    buffers, and flushes (optionally fsyncs) all files every flush_interval
+    seconds. Files closed on rotation are zipped in a thread pool.
+
+    conf["repo"]["writer"]:
+    {"background": true, "queueSize": 10000, "batchSize": 512,
+     "flushInterval": 1.0, "fsync": false, "archiveWorkers": 2}
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 10000,
+        batch_size: int = 512,
+        flush_interval: float = 1.0,
+        fsync: bool = False,
+        archive_workers: int = 2,
+        buffering: int = 1 << 20,
+    ):
+        super(WriterStage, self).__init__(daemon=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffering = buffering
+        self.executor = ThreadPoolExecutor(archive_workers)
+        self.repoWriters: list[RepoWriter] = []
+        self.error: Optional[Exception] = None
+
+        self.__queue = Queue(maxsize=queue_size)
+        self.__last_flush = time.time()
+        self.__reset_stats()
+
+    @classmethod
+    def from_conf(cls, conf: dict) -> "WriterStage":
+        return cls(
+            queue_size=conf.get("queueSize", 10000),
+            batch_size=conf.get("batchSize", 512),
+            flush_interval=conf.get("flushInterval", 1.0),
+            fsync=conf.get("fsync", False),
+            archive_workers=conf.get("archiveWorkers", 2),
+        )
+
+    def __reset_stats(self) -> None:
+        self.n_written = 0
+        self.n_batches = 0
+        self.latency_sum = 0.0  # put -> written
+        self.latency_max = 0.0
+        self.write_time_sum = 0.0  # time spent in write_record / flush
+
+    def register(self, repoWriter: RepoWriter) -> None:
+        """ call before the first put of repoWriter """
+        repoWriter.executor = self.executor
+        if repoWriter.buffering != self.buffering:
+            # reopen with a large buffer, writes are flushed by the stage
+            repoWriter.buffering = self.buffering
+            repoWriter.file.close()
+            repoWriter.file = repoWriter.open_file()
+        self.repoWriters.append(repoWriter)
+
+    def put(self, repoWriter: RepoWriter, period: int, data: dict) -> None:
+        item = (time.perf_counter(), repoWriter, period, data)
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.__queue.put(item, timeout=1.0)
+                return
+            except Full:
+                pass
+
+    def __drain(self) -> list:
+        try:
+            batch = [self.__queue.get(timeout=self.flush_interval or None)]
+        except Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.__queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def __flush(self) -> None:
+        for repoWriter in self.repoWriters:
+            repoWriter.flush(self.fsync)
+        self.__last_flush = time.time()
+
+    def __write(self, batch: list) -> None:
+        if not batch:
+            return
+
+        t0 = time.perf_counter()
+        for put_time, repoWriter, period, data in batch:
+            repoWriter.write_record(data, period)
+
+        if time.time() - self.__last_flush >= self.flush_interval:
+            self.__flush()
+
+        t1 = time.perf_counter()
+        self.write_time_sum += t1 - t0
+        self.n_written += len(batch)
+        self.n_batches += 1
+        for put_time, *_ in batch:
+            self.latency_sum += t1 - put_time
+            self.latency_max = max(self.latency_max, t1 - put_time)
+
+    def run(self):
+        """ override threading.Thread's "run" method. """
+        while True:
+            batch = self.__drain()
+            stop = None in batch
+            try:
+                self.__write([item for item in batch if item is not None])
+                if not batch:
+                    self.__flush()
+            except Exception as e:
+                self.error = e
+                raise e
+            if stop:
+                break
+
+    def stats(self, reset: bool = False) -> dict:
+        """
+        queue_depth: records waiting to be written
+        write_latency_*: seconds from put to written (queueing included)
+        write_time: seconds per record spent writing and flushing
+        """
+        n = max(self.n_written, 1)
+        stats = {
+            "queue_depth": self.__queue.qsize(),
+            "queue_size": self.__queue.maxsize,
+            "n_written": self.n_written,
+            "batch_size_avg": self.n_written / max(self.n_batches, 1),
+            "write_latency_avg": self.latency_sum / n,
+            "write_latency_max": self.latency_max,
+            "write_time": self.write_time_sum / n,
+        }
+        if reset:
+            self.__reset_stats()
+        return stats
+
+    def stop(self) -> None:
+        """ writes all queued records, closes and archives all files """
+        if self.is_alive():
+            self.__queue.put(None)
+            self.join()
+        for repoWriter in self.repoWriters:
+            repoWriter.close_file()
+        self.executor.shutdown(wait=True)
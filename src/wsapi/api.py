@@ -17,11 +17,18 @@ def get_nonce():
 class API:
     """ Kraken REST API """
 
-    def __init__(self, api_key: str = None, api_secret: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        api_secret: str = None,
+        session: requests.Session = None,
+    ):
         self.api_key = api_key
         self.api_secret = api_secret
         self.uri = "https://api.kraken.com"
         self.api_version = "0"
+        # keeps connections open between calls
+        self.session = session or requests.Session()
 
     def __sign(self, data: dict, url_path: str):
         assert self.api_key is not None and self.api_secret is not None
@@ -41,7 +48,7 @@ class API:
         headers = headers or {}
 
         url = self.uri + url_path
-        res = requests.post(url, data=data, headers=headers, timeout=timeout)
+        res = self.session.post(url, data=data, headers=headers, timeout=timeout)
 
         if not res.ok:
             res.raise_for_status()
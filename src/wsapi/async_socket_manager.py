@@ -0,0 +1,66 @@
+import asyncio
+from typing import AsyncIterator, Optional
+import websockets
+
+
+class AsyncSocketManager:
+    """
+    asyncio counterpart of SocketManager: received messages are awaited
+    as they arrive, instead of being buffered by a thread and polled.
+
+    send() is synchronous, so that WSAPI's subscribe methods work as is.
+    Messages sent before connect() are kept and sent once connected.
+
+    capacity: received messages websockets buffers before it stops reading
+    (backpressure, like the "block" overload of IngestBuffer).
+    """
+
+    def __init__(self, api_domain: str, timeout: int = 5, capacity=None):
+        self.api_domain = api_domain
+        self.timeout = timeout
+        self.capacity = capacity
+        self.ws = None
+
+        self.__pending: list[str] = []  # sent before connect()
+        self.__outbox: Optional[asyncio.Queue] = None
+        self.__sender: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self.ws = await websockets.connect(
+            self.api_domain,
+            open_timeout=self.timeout,
+            max_queue=self.capacity or 16,  # websockets' default
+        )
+        self.__outbox = asyncio.Queue()
+        for msg in self.__pending:
+            self.__outbox.put_nowait(msg)
+        self.__pending = []
+        self.__sender = asyncio.create_task(self.__send_loop())
+
+    def send(self, msg: str):
+        if self.__outbox is None:
+            self.__pending.append(msg)
+        else:
+            self.__outbox.put_nowait(msg)
+
+    async def __send_loop(self):
+        while True:
+            msg = await self.__outbox.get()
+            await self.ws.send(msg)
+
+    async def messages(self) -> AsyncIterator[str]:
+        """ yields messages until the connection is closed """
+        async for msg in self.ws:
+            if self.__sender.done():
+                self.__sender.result()  # raises the error of a failed send
+            yield msg
+
+    def stop(self):
+        if self.__sender is not None:
+            self.__sender.cancel()
+
+    async def close(self):
+        self.stop()
+        if self.ws is not None:
+            await self.ws.close()
+            print("closed connection")
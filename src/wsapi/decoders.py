@@ -0,0 +1,141 @@
+import json
+import time
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # optional, faster JSON backend
+    orjson = None
+
+
+"""
+Decoders turn a websocket frame (str) into the parsed message, the same
+as json.loads does:
+
+json:   json.loads
+orjson: orjson.loads, if installed
+book:   parser specialized on book frames, other messages go to json.loads
+auto:   orjson if installed, else json
+
+conf["wsapi"]["decoder"], default "auto". Compare them on recorded frames
+with bench_decoders.
+
+Book frames have a fixed shape, so the "book" decoder only has to split
+them at the quotes:
+
+[336,{"a":[["5541.3","2.5","1534614248.4"]],"c":"974942666"},"book-10","XBT/USD"]
+[336,{"a":[...]},{"b":[...],"c":"974942666"},"book-10","XBT/USD"]
+
+Anything else (spaces, escapes, empty sides) falls back to json.loads.
+"""
+
+Decoder = Callable[[str], Any]
+
+
+def decode_book_frame(raw: str) -> Any:
+    parts = raw.split('"')
+    head = parts[0]
+    if head[:1] != "[" or head[-2:] != ",{":
+        return json.loads(raw)  # events (dicts) and other subscriptions
+
+    # parts: separators at even, string contents (keys, values) at odd indices
+    strings = parts[1::2]
+    seps = parts[2::2]
+    frame = [int(head[1:-2])]
+    data = {}
+    i, n = 0, len(seps)
+    while i < n:
+        sep = seps[i]
+        if sep == ":[[":  # side: list of levels
+            key, start, rows = strings[i], i + 1, []
+            while True:
+                i += 1
+                tok = seps[i]
+                if tok == ",":
+                    continue
+                rows.append(strings[start : i + 1])
+                start = i + 1
+                if tok != "],[":
+                    break
+            if tok[:2] != "]]":
+                return json.loads(raw)
+            data[key] = rows
+            tok = tok[2:]
+        elif sep == ":":  # checksum
+            data[strings[i]] = strings[i + 1]
+            i += 1
+            tok = seps[i]
+        else:
+            return json.loads(raw)
+
+        i += 1
+        if tok == ",":
+            continue
+        frame.append(data)
+        if tok == "},{":  # asks and bids in separate dicts
+            data = {}
+            continue
+        if tok == "}," and seps[-1] == "]":
+            frame.extend(strings[i:])  # channel name, pair
+            return frame
+        return json.loads(raw)
+    return json.loads(raw)
+
+
+DECODERS: dict[str, Decoder] = {"json": json.loads, "book": decode_book_frame}
+if orjson is not None:
+    DECODERS["orjson"] = orjson.loads
+
+
+def get_decoder(name: Optional[str] = "auto") -> Decoder:
+    if name in (None, "auto"):
+        name = "orjson" if "orjson" in DECODERS else "json"
+    if name not in DECODERS:
+        raise ValueError(f"unknown decoder: {name} (available: {list(DECODERS)})")
+    return DECODERS[name]
+
+
+def get_book_data(frame: list) -> dict:
+    """ the update of a book frame, with asks and bids merged if sent apart """
+    if len(frame) == 4:
+        return frame[1]
+    data = {}
+    for item in frame[1:-2]:
+        data.update(item)
+    return data
+
+
+def get_recorded_frames(conf: dict[str, Any], assetPair, limit: int = 20000):
+    """ book frames as sent by kraken, rebuilt from the repo of assetPair """
+    from ..binary_format import to_plain
+    from ..repo import RepoReader
+
+    depth = conf["repo"]["depth"]
+    data_dir = conf["repo"]["dataDir"]
+    repoReader = RepoReader("KRAKEN", f"BOOK{depth}", assetPair.name, data_dir)
+
+    frames = []
+    for data in repoReader.data_generator():
+        frame = [0, to_plain(data["data"]), f"book-{depth}", assetPair.ws_name]
+        frames.append(json.dumps(frame, separators=(",", ":")))
+        if len(frames) >= limit:
+            break
+    return frames
+
+
+def bench_decoders(frames: list[str], repeat: int = 5) -> dict[str, float]:
+    """ best of repeat, mean microseconds per frame for every decoder """
+    results = {}
+    for name, decode in DECODERS.items():
+        expected = [json.loads(raw) for raw in frames[:100]]
+        if [decode(raw) for raw in frames[:100]] != expected:
+            raise ValueError(f"decoder {name} does not match json.loads")
+
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for raw in frames:
+                decode(raw)
+            best = min(best, time.perf_counter() - t0)
+        results[name] = best / max(len(frames), 1) * 1e6
+    return results
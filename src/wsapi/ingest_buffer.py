@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import deque
+from typing import Optional
+
+
+"""
+Bounded buffer between the receiving thread of SocketManager and the
+consumer (WSAPI.dispatch). What happens when it is full (overload):
+
+block: the receiving thread waits (backpressure on the connection)
+drop:  book updates are dropped, WSAPI resubscribes their channels
+
+Events (subscriptionStatus, ...) are always queued. Frames are never
+merged here: to catch up on the queued updates of a channel in one go,
+see coalescer (conf["wsapi"]["coalesce"]), which applies them in order.
+
+conf["wsapi"]["ingest"]: {"capacity": 100000, "overload": "block"}
+capacity null: unbounded
+"""
+
+OVERLOAD_POLICIES = ("block", "drop")
+
+
+def get_channel_id(raw: str) -> Optional[int]:
+    """ channel of a subscription update, None for events """
+    if not raw.startswith("["):
+        return None
+    return int(raw[1 : raw.index(",")])
+
+
+class IngestBuffer:
+    def __init__(self, capacity: Optional[int] = None, overload: str = "block"):
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError(f"unknown overload policy: {overload}")
+        self.capacity = capacity
+        self.overload = overload
+
+        self.n_dropped = 0
+        self.n_blocked = 0  # times the receiving thread had to wait
+
+        self.__items: deque[tuple[float, str]] = deque()  # (received at, raw)
+        self.__dropped_channels: set[int] = set()
+        self.__not_full = threading.Condition()
+        self.__closed = False
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def is_full(self) -> bool:
+        return self.capacity is not None and len(self.__items) >= self.capacity
+
+    def __has_room(self) -> bool:
+        return self.__closed or not self.is_full()
+
+    def oldest_age(self) -> float:
+        """ seconds the next item has been waiting """
+        try:
+            return time.time() - self.__items[0][0]
+        except IndexError:
+            return 0.0
+
+    def put(self, raw: str) -> None:
+        channel_id = get_channel_id(raw)
+        with self.__not_full:
+            if self.__closed:
+                return
+            if channel_id in self.__dropped_channels:
+                # the rest would be out of sync as well, until resubscribed
+                self.n_dropped += 1
+                return
+
+            if channel_id is not None and self.is_full():
+                if self.overload == "block":
+                    self.n_blocked += 1
+                    self.__not_full.wait_for(self.__has_room)
+                    if self.__closed:
+                        return
+                else:
+                    self.n_dropped += 1
+                    self.__dropped_channels.add(channel_id)
+                    return
+
+            self.__items.append((time.time(), raw))
+
+    def get(self) -> Optional[str]:
+        """ the next frame, None if empty """
+        with self.__not_full:
+            if not self.__items:
+                return None
+            _, raw = self.__items.popleft()
+            self.__not_full.notify()
+        return raw
+
+    def close(self) -> None:
+        """ wakes a waiting put, frames put from now on are discarded """
+        with self.__not_full:
+            self.__closed = True
+            self.__not_full.notify_all()
+
+    def take_dropped(self) -> set[int]:
+        """ channels that lost updates since the last call """
+        with self.__not_full:
+            dropped, self.__dropped_channels = self.__dropped_channels, set()
+        return dropped
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self.__items),
+            "oldest_age": self.oldest_age(),
+            "dropped": self.n_dropped,
+            "blocked": self.n_blocked,
+        }
@@ -1,7 +1,8 @@
 # import json
-from queue import Queue
 import threading
+from typing import Optional
 from websocket import create_connection
+from .ingest_buffer import IngestBuffer
 
 # from websocket._exceptions import WebSocketTimeoutException
 
@@ -9,18 +10,25 @@ from websocket import create_connection
 class SocketManager(threading.Thread):
     """
     SocketManager is a Convenience class that runs the webocket.recv()
-    method in a background thread, while using a queue.Queue() object
+    method in a background thread, while using a bounded IngestBuffer
     to buffer the received messages.
     """
 
-    def __init__(self, api_domain: str, timeout: int = 5):
+    def __init__(
+        self,
+        api_domain: str,
+        timeout: int = 5,
+        capacity: Optional[int] = None,
+        overload: str = "block",
+    ):
         super(SocketManager, self).__init__(daemon=False)
         self._connected_event = threading.Event()
 
         self.api_domain = api_domain
+        self.timeout = timeout
         self.ws = create_connection(self.api_domain, timeout=timeout)
 
-        self.__buffer = Queue()
+        self.buffer = IngestBuffer(capacity, overload)
         self.__is_stopped = False
 
     def send(self, msg: str):
@@ -28,12 +36,17 @@ class SocketManager(threading.Thread):
 
     def __listen(self):
         while not self.__is_stopped:
-            data = self.ws.recv()
+            try:
+                data = self.ws.recv()
+            except Exception as e:
+                if self.__is_stopped:
+                    break  # closed, see close
+                raise e
             # data = json.loads(data)
-            self.__buffer.put(data)
+            self.buffer.put(data)
 
     def listen(self):
-        return None if self.__buffer.empty() else self.__buffer.get()
+        return self.buffer.get()
 
     def run(self):
         """ override threading.Thread's "run" method. """
@@ -42,6 +55,15 @@ class SocketManager(threading.Thread):
     def stop(self):
         self.__is_stopped = True
 
+    def close(self):
+        """ stops receiving and closes the connection """
+        self.stop()
+        self.buffer.close()
+        if self.ws.connected:
+            self.ws.close()
+            print("closed connection")
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(self.timeout)
+
     def __del__(self):
-        self.ws.close()
-        print("closed connection")
+        self.close()
@@ -1,4 +1,4 @@
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
 
 def hash_(*args):
@@ -19,8 +19,10 @@ class Subscription:
         self.channel_id: Optional[int] = None
         self.subscription_msg: str = subscription_msg
         self.subscription_kwargs: dict = subscription_kwargs
-        self.currently_subscribed: bool = False
-        self.active: bool = False
+        self.is_currently_subscribed: bool = False
+        self.is_active: bool = False
+        # called with (data, raw) for every update of the channel, see WSAPI
+        self.handler: Optional[Callable[[list, str], None]] = None
 
     def has_reqid(self, reqid: int) -> bool:
         return reqid in self.reqids
@@ -33,24 +35,33 @@ class Subscription:
 
 
 class Subscriptions:
+    """
+    subscriptions indexed by public id, reqid and channel id. The channel
+    index doubles as the routing table for subscription updates (route).
+    """
+
     def __init__(self):
         self.subscriptions = []
+        self.__by_public_id: dict[int, Subscription] = {}
+        self.__by_reqid: dict[int, Subscription] = {}
+        self.__by_channel_id: dict[int, Subscription] = {}
 
     def __find_sub_by_public_id(self, public_id: int):
-        return next(filter(lambda x: x.public_id == public_id, self.subscriptions))
+        return self.__by_public_id[public_id]
 
     def __find_sub_by_channel_id(self, channel_id: int):
-        return next(filter(lambda x: x.channel_id == channel_id, self.subscriptions))
+        return self.__by_channel_id[channel_id]
 
     def __find_sub_by_reqid(self, reqid: int):
-        return next(filter(lambda x: x.has_reqid(reqid), self.subscriptions))
+        return self.__by_reqid[reqid]
 
     def __has_sub(self, public_id: int):
-        try:
-            self.__find_sub_by_public_id(public_id)
-            return True
-        except:
-            return False
+        return public_id in self.__by_public_id
+
+    def route(self, channel_id: int) -> Optional[Subscription]:
+        """ the active subscription of a channel, if any """
+        sub = self.__by_channel_id.get(channel_id)
+        return sub if sub is not None and sub.is_active else None
 
     def get_is_active(self, key_channel_id: int) -> bool:
         return self.__find_sub_by_channel_id(key_channel_id).is_active
@@ -65,8 +76,13 @@ class Subscriptions:
         sub = self.__find_sub_by_public_id(key_public_id)
         return sub.subscription_msg, sub.subscription_kwargs
 
+    def set_handler(self, key_public_id: int, handler: Callable[[list, str], None]):
+        self.__find_sub_by_public_id(key_public_id).handler = handler
+
     def add_reqid(self, key_public_id: int, reqid: int):
-        self.__find_sub_by_public_id(key_public_id).add_reqid(reqid)
+        sub = self.__find_sub_by_public_id(key_public_id)
+        sub.add_reqid(reqid)
+        self.__by_reqid[reqid] = sub
 
     def add_subscription(self, subscription_msg, subscription_kwargs) -> int:
         public_id = hash_(subscription_msg, subscription_kwargs)
@@ -75,6 +91,7 @@ class Subscriptions:
 
         sub = Subscription(public_id, subscription_msg, subscription_kwargs)
         self.subscriptions.append(sub)
+        self.__by_public_id[public_id] = sub
         return public_id
 
     def change_sub_is_active(
@@ -98,7 +115,11 @@ class Subscriptions:
         sub.is_currently_subscribed = is_currently_subscribed
 
     def change_channel_id(self, key_reqid: int, channel_id: int):
-        self.__find_sub_by_reqid(key_reqid).channel_id = channel_id
+        sub = self.__find_sub_by_reqid(key_reqid)
+        if self.__by_channel_id.get(sub.channel_id) is sub:
+            del self.__by_channel_id[sub.channel_id]
+        sub.channel_id = channel_id
+        self.__by_channel_id[channel_id] = sub
 
     def remove_reqid(self, key_reqid: int):
-        self.__find_sub_by_reqid(key_reqid).remove_reqid(key_reqid)
+        self.__by_reqid.pop(key_reqid).remove_reqid(key_reqid)
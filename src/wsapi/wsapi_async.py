@@ -0,0 +1,56 @@
+from typing import AsyncIterator, Optional, Tuple
+from .async_socket_manager import AsyncSocketManager
+from .decoders import get_decoder
+from .subscription import Subscriptions
+from .wsapi_public import WSAPI, Counter
+
+
+class AsyncWSAPI(WSAPI):
+    """
+    asyncio version of WSAPI. Subscribing works the same (and may happen
+    before connect), but messages are consumed with "async for" and
+    handled as soon as they arrive:
+
+    await wsapi.connect()
+    async for public_id, data, raw in wsapi.listen_raw_gen():
+        ...
+    """
+
+    def __init__(
+        self,
+        decoder: Optional[str] = "auto",
+        api_domain: Optional[str] = None,
+        capacity: Optional[int] = None,
+        overload: str = "block",
+    ):
+        # no super().__init__, it would start the threaded connection
+        if api_domain is not None:
+            self._api_domain = api_domain
+        if overload != "block":
+            # websockets stops reading when its queue is full, nothing else
+            raise ValueError(f"overload {overload} needs the threaded WSAPI")
+        self.connection = AsyncSocketManager(self._api_domain, 5, capacity)
+        self.decode = get_decoder(decoder)
+        self.get_nonce = Counter()
+        self.subs = Subscriptions()
+
+    async def connect(self):
+        await self.connection.connect()
+
+    async def close(self):
+        await self.connection.close()
+
+    async def listen_raw_gen(self) -> AsyncIterator[Tuple[int, list, str]]:
+        async for raw in self.connection.messages():
+            data = self._parse_message(raw)
+            if data is not None:
+                yield data.get("public_id"), data.get("data"), data.get("raw")
+
+    async def dispatch(self):
+        """ handles messages as they arrive, until the connection is closed """
+        async for raw in self.connection.messages():
+            self._parse_message(raw)
+
+    async def listen_gen(self) -> AsyncIterator[Tuple[int, list]]:
+        async for public_id, data, _ in self.listen_raw_gen():
+            yield public_id, data
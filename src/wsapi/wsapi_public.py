@@ -1,12 +1,14 @@
 import json
+import time
 
-from typing import Iterator, Tuple
+from typing import Callable, Iterator, Optional, Tuple
+from .decoders import get_decoder
 from .socket_manager import SocketManager
 from .subscription import Subscriptions
 
 
-def _add_connection(api_domain: str):
-    connection = SocketManager(api_domain, timeout=5)
+def _add_connection(api_domain: str, capacity=None, overload="block"):
+    connection = SocketManager(api_domain, 5, capacity, overload)
     connection.start()
     return connection
 
@@ -33,9 +35,22 @@ class WSAPI:
     """
 
     _api_domain: str = "wss://ws.kraken.com/"
-
-    def __init__(self):
-        self.connection = _add_connection(self._api_domain)
+    decode_time: float = 0.0  # seconds, of the message handled last (stats)
+    # called with the public_id of every channel resubscribed for dropped updates
+    on_resubscribe_dropped: Optional[Callable[[int], None]] = None
+
+    def __init__(
+        self,
+        decoder: Optional[str] = "auto",
+        api_domain: Optional[str] = None,
+        capacity: Optional[int] = None,
+        overload: str = "block",
+    ):
+        """ capacity, overload: of the ingest buffer, see ingest_buffer """
+        if api_domain is not None:
+            self._api_domain = api_domain  # e.g. a local replay_server
+        self.connection = _add_connection(self._api_domain, capacity, overload)
+        self.decode = get_decoder(decoder)  # see decoders
         self.get_nonce = Counter()
         self.subs = Subscriptions()
 
@@ -89,12 +104,18 @@ class WSAPI:
         if data["event"] == "error":
             raise ValueError(data["errorMessage"])
 
-    def __handle_external_messages(self, data: list):
-        """ parse subscription updates """
-        channel_id = data[0]
-        if self.subs.get_is_active(channel_id):
-            public_id = self.subs.get_public_id(key_channel_id=channel_id)
-            return {"public_id": public_id, "data": data}
+    def __handle_external_messages(self, data: list, raw: str):
+        """
+        parse subscription updates. Updates of subscriptions with a handler
+        (see set_handler) are passed to it right away, the others returned.
+        """
+        sub = self.subs.route(data[0])
+        if sub is None:
+            return None
+        if sub.handler is not None:
+            sub.handler(data, raw)
+            return None
+        return {"public_id": sub.public_id, "data": data, "raw": raw}
 
     def __listen(self):
         """
@@ -105,22 +126,52 @@ class WSAPI:
         * external events ("addOrder", "cancelOrder", etc...)
         3. sentinel -> data type == None
         """
-        data = self.connection.listen()
-
-        # Sentinel Case
-        if data is None:
-            return data
+        while True:
+            data = self.connection.listen()
 
-        data = json.loads(data)
+            # Sentinel Case
+            if data is None:
+                self.__resubscribe_dropped()
+                return data
+
+            external_msg = self._parse_message(data)
+            if external_msg is not None:
+                return external_msg
+
+    def __resubscribe_dropped(self):
+        """ channels that lost updates to the ingest buffer (overload "drop") """
+        for channel_id in self.connection.buffer.take_dropped():
+            sub = self.subs.route(channel_id)
+            if sub is not None:
+                self.resubscribe_public(sub.public_id)
+                if self.on_resubscribe_dropped is not None:
+                    self.on_resubscribe_dropped(sub.public_id)
+
+    def _parse_message(self, raw: str) -> Optional[dict]:
+        """ handles internal messages, returns unhandled subscription updates """
+        start = time.perf_counter()
+        data = self.decode(raw)
+        self.decode_time = time.perf_counter() - start
         # External/Outgoing Message
         if type(data) == list:
-            external_msg = self.__handle_external_messages(data)
-            return self.__listen() if external_msg is None else external_msg
+            return self.__handle_external_messages(data, raw)
 
         # Internal Message
         if type(data) == dict:
             self.__handle_internal_messages(data)
-            return self.__listen()
+        return None
+
+    def set_handler(self, public_id: int, handler: Callable[[list, str], None]):
+        """ handler(data, raw) is called for every update of the subscription """
+        self.subs.set_handler(public_id, handler)
+
+    def dispatch(self):
+        """
+        handles all received messages. Updates of subscriptions without a
+        handler are dropped, use listen_gen for those.
+        """
+        while self.__listen() is not None:
+            pass
 
     def listen(self):
         return self.__listen()
@@ -133,5 +184,15 @@ class WSAPI:
             yield data.get("public_id"), data.get("data")
             data = self.__listen()
 
+    def listen_raw_gen(self) -> Iterator[Tuple[int, list, str]]:
+        """ same as listen_gen, plus the frame as received """
+        data = self.__listen()
+        while data is not None:
+            yield data.get("public_id"), data.get("data"), data.get("raw")
+            data = self.__listen()
+
+    def close(self):
+        self.connection.close()
+
     def __del__(self):
         self.connection.stop()